@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       ftp_soak.py
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""
+Soak test of the ftp sync path. Starts a local ftp server (pyftpdlib) with
+injected latency per command and a bandwidth limit, and lets several
+clients, each with a database of its own, edit tasks at random and sync
+concurrently. Reports the sync throughput, sync duration percentiles, the
+contention on the remote lock file, the clients whose last sync failed
+and whether all replicas converged after a final round of syncs.
+
+Needs pyftpdlib (pip install pyftpdlib).
+
+Usage: python benchmarks/ftp_soak.py [--clients 4] [--size 1000]
+            [--seconds 30] [--latency 0.01] [--bandwidth 0]
+            [--fraction 0.01]
+"""
+import json
+import logging
+import optparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from lock_contention import percentile
+from simple_db_bench import Task, make_database, diverge
+from simple_db.database import DataBase, STORAGE_FORMAT_COMPACT
+import sync_core
+import sync_trace
+import transports
+
+try:
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler, ThrottledDTPHandler
+    from pyftpdlib.servers import ThreadedFTPServer
+except ImportError:
+    FTPHandler = None
+
+USER = "soak"
+PASSWORD = "soak"
+#maximum pause after a sync failed because another client held the lock
+LOCKED_BACKOFF = 0.5
+
+
+def start_server(directory, latency, bandwidth):
+    """
+    Serves directory on a free port in a background thread. Every command
+    is delayed by latency seconds, data transfers are limited to bandwidth
+    bytes per second (0 means no limit). Returns the server.
+    """
+    authorizer = DummyAuthorizer()
+    authorizer.add_user(USER, PASSWORD, directory, perm="elradfmwMT")
+
+    class DTPHandler(ThrottledDTPHandler):
+        read_limit = bandwidth
+        write_limit = bandwidth
+
+    class Handler(FTPHandler):
+        def pre_process_command(self, line, cmd, arg):
+            time.sleep(latency)
+            FTPHandler.pre_process_command(self, line, cmd, arg)
+
+    Handler.authorizer = authorizer
+    Handler.dtp_handler = DTPHandler
+    #pyftpdlib logs every command unless logging is configured already
+    logging.basicConfig(level=logging.WARNING)
+    server = ThreadedFTPServer(("127.0.0.1", 0), Handler)
+    t = threading.Thread(target=server.serve_forever, \
+                            kwargs={"handle_exit": False})
+    t.setDaemon(True)
+    t.start()
+    return server
+
+
+def sync(db, server, history, rnd, stats):
+    """
+    Syncs db until the remote lock could be acquired. Other sync errors
+    are recorded in stats, the client is failed until a sync succeeds.
+    """
+    start = time.time()
+    while True:
+        try:
+            sync_core.sync_tasks(db, Task, server, USER, PASSWORD, "/", \
+                                    history=history)
+            break
+        except sync_core.ErrorLocked:
+            stats["locked"] += 1
+            time.sleep(rnd.uniform(0, LOCKED_BACKOFF))
+        except sync_core.ErrorConflict:
+            stats["conflicts"] += 1
+        except sync_core.Error, e:
+            stats["errors"].append("%s: %s" % (e.__class__.__name__, e))
+            stats["failed"] = True
+            return
+    stats["failed"] = False
+    entry = history.last()
+    phases = dict((p["name"], p["duration"]) for p in entry["phases"])
+    stats["durations"].append(entry["duration"])
+    stats["lock_phases"].append(phases["lock"])
+    stats["waits"].append(time.time() - start - entry["duration"])
+
+
+def client(i, tmp_dir, server, seconds, fraction, stats):
+    rnd = random.Random(i)
+    db = DataBase(os.path.join(tmp_dir, "client-%d.xml" % i), Task)
+    db.add_sync_source("ftp")
+    history = sync_trace.SyncHistory(os.path.join(tmp_dir, \
+                                                    "history-%d" % i))
+    #the final syncs of run() need them even if this client fails
+    stats["db"] = db
+    stats["history"] = history
+    sync(db, server, history, rnd, stats)
+    if stats["failed"]:
+        #there are no tasks to edit without the remote ones
+        return
+    end = time.time() + seconds
+    round = 0
+    while time.time() < end:
+        diverge(db, rnd, "client-%d-%d" % (i, round), fraction)
+        db.commit()
+        sync(db, server, history, rnd, stats)
+        round += 1
+
+
+def contents(db):
+    return sorted((obj.id, tuple(obj[field] for field in Task.fields)) \
+                    for obj in db.query())
+
+
+def run(options):
+    tmp_dir = tempfile.mkdtemp(prefix="ftp_soak")
+    try:
+        ftp_dir = os.path.join(tmp_dir, "ftp")
+        os.mkdir(ftp_dir)
+        remote_file = os.path.join(ftp_dir, transports.REMOTE_DB_FILE)
+        make_database(remote_file, options.size, STORAGE_FORMAT_COMPACT)
+        #the sync source of make_database would keep every tombstone
+        remote_db = DataBase(remote_file, Task)
+        remote_db.remove_sync_source("bench")
+        remote_db.commit()
+        server = start_server(ftp_dir, options.latency, options.bandwidth)
+        address = "%s:%d" % server.address[:2]
+
+        stats = []
+        threads = []
+        start = time.time()
+        for i in range(options.clients):
+            s = {"locked": 0, "conflicts": 0, "durations": [], \
+                    "lock_phases": [], "waits": [], "errors": [], \
+                    "failed": True}
+            stats.append(s)
+            threads.append(threading.Thread(target=client, \
+                            args=(i, tmp_dir, address, options.seconds, \
+                                    options.fraction, s)))
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.time() - start
+
+        #two rounds without edits: the first collects every change on the
+        #server, the second hands them to every client
+        for r in range(2):
+            for s in stats:
+                sync(s["db"], address, s["history"], random.Random(), s)
+        server.close_all()
+
+        durations = sorted(sum([s["durations"] for s in stats], []))
+        lock_phases = sorted(sum([s["lock_phases"] for s in stats], []))
+        waits = sorted(sum([s["waits"] for s in stats], []))
+        expected = contents(DataBase(remote_file, Task))
+        converged = [contents(s["db"]) == expected for s in stats]
+        return {"clients": options.clients,
+                "size": options.size,
+                "latency": options.latency,
+                "bandwidth": options.bandwidth,
+                "wall": wall,
+                "syncs": len(durations),
+                "syncs_per_second": len(durations) / wall,
+                "sync_p50": percentile(durations, 0.5),
+                "sync_p95": percentile(durations, 0.95),
+                "sync_p99": percentile(durations, 0.99),
+                "lock_phase_p50": percentile(lock_phases, 0.5),
+                "lock_phase_p95": percentile(lock_phases, 0.95),
+                "lock_wait_p50": percentile(waits, 0.5),
+                "lock_wait_p95": percentile(waits, 0.95),
+                "locked_attempts": sum(s["locked"] for s in stats),
+                "conflicts": sum(s["conflicts"] for s in stats),
+                "sync_errors": sum([s["errors"] for s in stats], []),
+                "failed_clients": [i for i, s in enumerate(stats) \
+                                    if s["failed"]],
+                "tasks": len(expected),
+                "converged": False not in converged}
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--clients", type="int", default=4)
+    parser.add_option("--size", type="int", default=1000)
+    parser.add_option("--seconds", type="float", default=30.0)
+    parser.add_option("--latency", type="float", default=0.01, \
+                        help="delay of every ftp command in seconds")
+    parser.add_option("--bandwidth", type="int", default=0, \
+                        help="bytes per second, 0 means no limit")
+    parser.add_option("--fraction", type="float", default=0.01, \
+                        help="fraction of the tasks edited between syncs")
+    options, args = parser.parse_args()
+    if FTPHandler == None:
+        sys.exit("ftp_soak.py needs pyftpdlib")
+    report = run(options)
+    sys.stdout.write(json.dumps(report, indent=2, sort_keys=True) + "\n")
+    if not report["converged"] or len(report["failed_clients"]) > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       http_standin.py
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""
+A small in-memory HTTP server that stands in for a WebDAV server, so that
+the sync pipeline can be run and benchmarked offline. It supports GET, PUT
+and DELETE with ETags and the If-Match and If-None-Match conditions and can
+add a fixed latency to every request.
+
+Usage: python benchmarks/http_standin.py [--port 8080] [--latency 0.05]
+"""
+import BaseHTTPServer
+import hashlib
+import optparse
+import SocketServer
+import threading
+import time
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    
+    protocol_version = "HTTP/1.1"
+    
+    def log_message(self, format, *args):
+        pass
+        
+    def _reply(self, status, etag=None, body=""):
+        self.send_response(status)
+        if etag != None:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        
+    def _precondition_failed(self, etag):
+        if_match = self.headers.getheader("If-Match")
+        if_none_match = self.headers.getheader("If-None-Match")
+        if if_match != None and if_match != etag:
+            return True
+        if if_none_match == "*" and etag != None:
+            return True
+        return False
+        
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        self.server.requests += 1
+        data, etag = self.server.files.get(self.path, (None, None))
+        if data == None:
+            self._reply(404)
+        elif self.headers.getheader("If-None-Match") == etag:
+            self._reply(304, etag)
+        else:
+            self.server.bytes_sent += len(data)
+            self._reply(200, etag, data)
+            
+    def do_PUT(self):
+        time.sleep(self.server.latency)
+        self.server.requests += 1
+        data = self.rfile.read(int(self.headers.getheader("Content-Length")))
+        self.server.lock.acquire()
+        try:
+            old_data, etag = self.server.files.get(self.path, (None, None))
+            if self._precondition_failed(etag):
+                self._reply(412)
+                return
+            etag = '"%s"' % hashlib.md5(data).hexdigest()
+            self.server.files[self.path] = (data, etag)
+            self.server.bytes_received += len(data)
+        finally:
+            self.server.lock.release()
+        if old_data == None:
+            self._reply(201, etag)
+        else:
+            self._reply(204, etag)
+            
+    def do_DELETE(self):
+        time.sleep(self.server.latency)
+        self.server.requests += 1
+        self.server.lock.acquire()
+        try:
+            if self.path in self.server.files:
+                del self.server.files[self.path]
+                self._reply(204)
+            else:
+                self._reply(404)
+        finally:
+            self.server.lock.release()
+            
+            
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Serves the stand-in on address, port 0 picks a free port. start() runs
+    it in a background thread.
+    """
+    
+    daemon_threads = True
+    
+    def __init__(self, address=("127.0.0.1", 0), latency=0):
+        BaseHTTPServer.HTTPServer.__init__(self, address, StandInHandler)
+        self.latency = latency
+        self.files = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        
+    def get_url(self, path="/tasks"):
+        return "http://%s:%d%s" % (self.server_address[0], \
+                                    self.server_address[1], path)
+        
+    def start(self):
+        t = threading.Thread(target=self.serve_forever)
+        t.setDaemon(True)
+        t.start()
+        
+        
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--port", type="int", default=8080)
+    parser.add_option("--latency", type="float", default=0)
+    options, args = parser.parse_args()
+    server = StandInServer(("127.0.0.1", options.port), options.latency)
+    print "serving on %s" % server.get_url()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       lock_contention.py
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""
+Measures the latency of UI-like reads (lookups, membership tests and small
+queries) on a DataBase while a background thread keeps syncing or
+committing it.
+
+Usage: python benchmarks/lock_contention.py [--size 10000] [--readers 2]
+            [--seconds 5]
+"""
+import json
+import optparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from simple_db_bench import Task, make_database, diverge
+from simple_db.database import DataBase, STORAGE_FORMAT_COMPACT
+
+
+def percentile(values, p):
+    if len(values) == 0:
+        return None
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def reader(db, ids, seconds, latencies, seed):
+    rnd = random.Random(seed)
+    end = time.time() + seconds
+    while time.time() < end:
+        start = time.time()
+        op = rnd.random()
+        if op < 0.6:
+            id = rnd.choice(ids)
+            if id in db:
+                db[id]["title"]
+        elif op < 0.99:
+            rnd.choice(ids) in db
+        else:
+            db.query(lambda x: x["due_date"] == -1)
+        latencies.append(time.time() - start)
+
+
+def syncer(db, base, tmp_dir, stop, counter):
+    i = 0
+    while not stop.isSet():
+        remote_file = os.path.join(tmp_dir, "remote.xml")
+        shutil.copy(base, remote_file)
+        remote = DataBase(remote_file, Task)
+        diverge(remote, random.Random(i), "remote-%d" % i, 0.001)
+        db.sync("bench", remote)
+        counter.append(1)
+        i += 1
+
+
+def committer(db, base, tmp_dir, stop, counter):
+    while not stop.isSet():
+        db.commit()
+        counter.append(1)
+
+
+def run(size, n_readers, seconds, background):
+    tmp_dir = tempfile.mkdtemp(prefix="lock_contention")
+    try:
+        base = os.path.join(tmp_dir, "base.xml")
+        make_database(base, size, STORAGE_FORMAT_COMPACT)
+        local_file = os.path.join(tmp_dir, "local.xml")
+        shutil.copy(base, local_file)
+        db = DataBase(local_file, Task, stats=True)
+        ids = [obj.id for obj in db.query()]
+
+        stop = threading.Event()
+        counter = []
+        bg = None
+        if background != None:
+            bg = threading.Thread(target=background, \
+                                    args=(db, base, tmp_dir, stop, counter))
+            bg.start()
+        latencies = []
+        threads = []
+        for i in range(n_readers):
+            l = []
+            latencies.append(l)
+            threads.append(threading.Thread(target=reader, \
+                                            args=(db, ids, seconds, l, i)))
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        stop.set()
+        if bg != None:
+            bg.join()
+
+        all_latencies = []
+        for l in latencies:
+            all_latencies.extend(l)
+        all_latencies.sort()
+        stats = db.stats()
+        return {"reads": len(all_latencies),
+                "reads_per_second": len(all_latencies) / float(seconds),
+                "read_p50": percentile(all_latencies, 0.5),
+                "read_p95": percentile(all_latencies, 0.95),
+                "read_p99": percentile(all_latencies, 0.99),
+                "read_max": all_latencies[-1],
+                "background_ops": len(counter),
+                "lock_wait_read": stats.get("lock_wait.read"),
+                "lock_wait_write": stats.get("lock_wait.write")}
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--size", type="int", default=10000)
+    parser.add_option("--readers", type="int", default=2)
+    parser.add_option("--seconds", type="float", default=5.0)
+    options, args = parser.parse_args()
+    report = {}
+    for name, background in [("readers_only", None), \
+                                ("with_sync", syncer), \
+                                ("with_commit", committer)]:
+        report[name] = run(options.size, options.readers, options.seconds, \
+                            background)
+        sys.stderr.write("%s done\n" % name)
+    sys.stdout.write(json.dumps(report, indent=2, sort_keys=True) + "\n")
+
+
+if __name__ == "__main__":
+    main()
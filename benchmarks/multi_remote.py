@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       multi_remote.py
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""
+Syncs one local database with several HTTP stand-ins (see http_standin.py)
+of different latencies, one remote after the other and concurrently, and
+reports the wall time of every round next to the slowest single remote.
+
+Usage: python benchmarks/multi_remote.py [--size 5000]
+            [--latencies 0.01,0.02,0.05,0.1]
+"""
+import json
+import optparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from simple_db_bench import Task, make_database, diverge
+from http_standin import StandInServer
+from simple_db.database import DataBase, STORAGE_FORMAT_COMPACT
+import sync_core
+import sync_trace
+import transports
+
+
+def run(base, tmp_dir, latencies, max_workers):
+    local_file = os.path.join(tmp_dir, "local-%d.xml" % max_workers)
+    shutil.copy(base, local_file)
+    db = DataBase(local_file, Task)
+    servers = []
+    remotes = []
+    for i, latency in enumerate(latencies):
+        server = StandInServer(latency=latency)
+        server.start()
+        servers.append(server)
+        remotes.append(("remote-%d" % i, \
+                        transports.WebDAVTransport(server.get_url())))
+    history = sync_trace.SyncHistory(os.path.join(tmp_dir, "history"))
+    results = {}
+    try:
+        for name in ["first", "unchanged", "changed"]:
+            if name == "changed":
+                diverge(db, random.Random(0), "local", 0.001)
+            start = time.time()
+            errors = sync_core.sync_many(db, Task, remotes, history=history, \
+                                            max_workers=max_workers)
+            wall = time.time() - start
+            entries = history.entries()[-len(remotes):]
+            results[name] = {"wall": wall,
+                                "slowest": max(e["duration"] for e in entries),
+                                "sum": sum(e["duration"] for e in entries),
+                                "errors": len([e for e in errors.values() \
+                                                if e != None])}
+    finally:
+        for server in servers:
+            server.shutdown()
+    return results
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--size", type="int", default=5000)
+    parser.add_option("--latencies", default="0.01,0.02,0.05,0.1")
+    options, args = parser.parse_args()
+    latencies = [float(l) for l in options.latencies.split(",")]
+    tmp_dir = tempfile.mkdtemp(prefix="multi_remote")
+    try:
+        base = os.path.join(tmp_dir, "base.xml")
+        make_database(base, options.size, STORAGE_FORMAT_COMPACT)
+        report = {"size": options.size, "latencies": latencies}
+        report["serial"] = run(base, tmp_dir, latencies, 1)
+        sys.stderr.write("serial done\n")
+        report["concurrent"] = run(base, tmp_dir, latencies, len(latencies))
+        sys.stderr.write("concurrent done\n")
+    finally:
+        shutil.rmtree(tmp_dir)
+    sys.stdout.write(json.dumps(report, indent=2, sort_keys=True) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       parallel_load.py
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""
+Measures how loading a large compact database file scales with the number
+of parser processes, compared to the serial loader.
+
+Usage: python benchmarks/parallel_load.py [--size 100000] [--repeat 3]
+            [--processes 1,2,4,8]
+"""
+import json
+import multiprocessing
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from simple_db_bench import Task, make_database, summarize, timed
+from simple_db import database, loader
+from simple_db.database import DataBase, STORAGE_FORMAT_COMPACT
+
+
+def load_times(filename, repeat):
+    return summarize([timed(lambda: DataBase(filename, Task)) \
+                        for i in range(repeat)])
+
+
+def main():
+    cpus = multiprocessing.cpu_count()
+    counts = []
+    n = 1
+    while n < cpus:
+        counts.append(n)
+        n *= 2
+    counts.append(cpus)
+    parser = optparse.OptionParser()
+    parser.add_option("--size", type="int", default=100000)
+    parser.add_option("--repeat", type="int", default=3)
+    parser.add_option("--processes", default=",".join(map(str, counts)))
+    options, args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="parallel_load")
+    try:
+        filename = os.path.join(tmp_dir, "db.xml")
+        make_database(filename, options.size, STORAGE_FORMAT_COMPACT)
+        report = {"size": options.size, "cpus": cpus,
+                    "file_size": os.path.getsize(filename)}
+
+        database.PARALLEL_LOAD_THRESHOLD = sys.maxint
+        report["serial"] = load_times(filename, options.repeat)
+        sys.stderr.write("serial done\n")
+
+        #also measure the pool on machines with a single cpu
+        loader.available = lambda: True
+        database.PARALLEL_LOAD_THRESHOLD = 0
+        report["parallel"] = {}
+        for processes in map(int, options.processes.split(",")):
+            database.PARALLEL_LOAD_PROCESSES = processes
+            result = load_times(filename, options.repeat)
+            result["speedup"] = report["serial"]["median"] / result["median"]
+            report["parallel"][processes] = result
+            sys.stderr.write("%d processes done\n" % processes)
+    finally:
+        shutil.rmtree(tmp_dir)
+    sys.stdout.write(json.dumps(report, indent=2, sort_keys=True) + "\n")
+
+
+if __name__ == "__main__":
+    main()
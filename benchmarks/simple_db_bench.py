@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       simple_db_bench.py
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""
+Benchmarks for simple_db: load, commit, query with sorting, single field
+edit plus commit, syncing two diverged copies of a database and archiving
+one percent of the objects. The archived objects have non-ascii comments
+and are read back, a case fails if they changed.
+
+Every (size, storage format) case runs in its own process so that the
+reported peak memory belongs to that case only. The results are written as
+JSON to stdout or to the file given with --output.
+
+Usage: python benchmarks/simple_db_bench.py [--sizes 1000,10000,100000]
+            [--formats compact,normal] [--repeat 3] [--output FILE]
+"""
+import json
+import optparse
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+from simple_db.database import DataBase, STORAGE_FORMAT_COMPACT, \
+                                STORAGE_FORMAT_NORMAL
+from simple_db.dataobject import DataObject
+
+FORMATS = {"compact": STORAGE_FORMAT_COMPACT,
+            "normal": STORAGE_FORMAT_NORMAL}
+WORDS = ["buy", "milk", "call", "mom", "write", "report", "fix", "bike",
+            "book", "flight", "pay", "rent", "clean", "kitchen", "read",
+            "paper", "review", "patch", "water", "plants"]
+ARCHIVE_COMMENT = u"r\xe9sum\xe9 f\xfcr M\xfcller \u2013 \u00bd"
+
+
+class Task(DataObject):
+    fields = ["title", "comment", "due_date", "done"]
+
+
+def make_task(rnd, id):
+    t = Task(id)
+    t["title"] = " ".join(rnd.sample(WORDS, 3))
+    if rnd.random() < 0.3:
+        t["comment"] = " ".join(rnd.sample(WORDS, 10))
+    else:
+        t["comment"] = ""
+    if rnd.random() < 0.5:
+        t["due_date"] = int(time.time()) + rnd.randint(-30, 60) * 86400
+    else:
+        t["due_date"] = -1
+    t["done"] = rnd.random() < 0.4
+    return t
+
+
+def make_database(filename, size, storage_format, seed=0):
+    """
+    Writes a synthetic task database with size tasks to filename. The
+    database has a sync source 'bench' that is in sync with the file.
+    """
+    rnd = random.Random(seed)
+    if os.path.exists(filename):
+        os.remove(filename)
+    db = DataBase(filename, Task)
+    db.storage_format = storage_format
+    for i in xrange(size):
+        db.add(make_task(rnd, "task-%d" % i))
+    db.add_sync_source("bench")
+    db.commit()
+    #sync with an identical copy to set a proper last sync time
+    db.sync("bench", DataBase(filename, Task))
+    db.commit()
+
+
+def diverge(db, rnd, prefix, fraction=0.01):
+    """
+    Edits, adds and deletes a fraction of the objects in db.
+    """
+    ids = [obj.id for obj in db.query()]
+    n = max(1, int(len(ids) * fraction))
+    for id in rnd.sample(ids, n):
+        db[id]["title"] = "%s edit %d" % (prefix, rnd.randint(0, 1000))
+    for i in xrange(n):
+        db.add(make_task(rnd, "%s-new-%d" % (prefix, i)))
+    for id in rnd.sample(ids, max(1, n / 2)):
+        if id in db:
+            del db[id]
+
+
+def timed(func):
+    start = time.time()
+    func()
+    return time.time() - start
+
+
+def summarize(times):
+    times = sorted(times)
+    return {"min": times[0], "median": times[len(times) / 2],
+            "max": times[-1], "runs": len(times)}
+
+
+def run_case(size, format_name, repeat):
+    """
+    Runs all benchmarks for one database size and storage format and
+    returns the results as a dict.
+    """
+    storage_format = FORMATS[format_name]
+    tmp_dir = tempfile.mkdtemp(prefix="simple_db_bench")
+    try:
+        base = os.path.join(tmp_dir, "base.xml")
+        make_database(base, size, storage_format)
+        results = {"size": size, "format": format_name,
+                    "file_size": os.path.getsize(base)}
+
+        times = []
+        for i in range(repeat):
+            times.append(timed(lambda: DataBase(base, Task)))
+        results["load"] = summarize(times)
+
+        db = DataBase(base, Task)
+        db.storage_format = storage_format
+        results["commit"] = summarize([timed(db.commit) \
+                                        for i in range(repeat)])
+
+        def query():
+            db.query(lambda x: not x["done"], \
+                        lambda x, y: cmp(x["due_date"], y["due_date"]))
+        results["query_sorted"] = summarize([timed(query) \
+                                                for i in range(repeat)])
+
+        ids = [obj.id for obj in db.query()]
+        rnd = random.Random(1)
+        def edit():
+            db[rnd.choice(ids)]["title"] = "edited"
+            db.commit()
+        results["edit_commit"] = summarize([timed(edit) \
+                                            for i in range(repeat)])
+
+        times = []
+        for i in range(repeat):
+            local_file = os.path.join(tmp_dir, "local.xml")
+            remote_file = os.path.join(tmp_dir, "remote.xml")
+            shutil.copy(base, local_file)
+            shutil.copy(base, remote_file)
+            local = DataBase(local_file, Task)
+            remote = DataBase(remote_file, Task)
+            diverge(local, random.Random(i), "local")
+            diverge(remote, random.Random(i + 1000), "remote")
+            times.append(timed(lambda: local.sync("bench", remote)))
+        results["sync"] = summarize(times)
+
+        archive_file = os.path.join(tmp_dir, "archive.xml")
+        shutil.copy(base, archive_file)
+        archive_db = DataBase(archive_file, Task)
+        archive_ids = ids[:max(1, size / 100)]
+        for id in archive_ids:
+            archive_db[id]["comment"] = ARCHIVE_COMMENT
+        def archive():
+            archive_db.archive(archive_ids)
+            archive_db.commit()
+        results["archive"] = summarize([timed(archive)])
+        archived = DataBase(archive_file, Task).load_archive()
+        for id in archive_ids:
+            if archived[id]["comment"] != ARCHIVE_COMMENT:
+                raise ValueError("archived object %s changed" % id)
+
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        results["peak_rss_kb"] = usage.ru_maxrss
+        return results
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def get_revision():
+    try:
+        p = subprocess.Popen(["git", "rev-parse", "HEAD"], \
+                                stdout=subprocess.PIPE, \
+                                stderr=subprocess.PIPE, \
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        return p.communicate()[0].strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--sizes", default="1000,10000,100000")
+    parser.add_option("--formats", default="compact,normal")
+    parser.add_option("--repeat", type="int", default=3)
+    parser.add_option("--output", default=None)
+    parser.add_option("--case", default=None, help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args()
+
+    if options.case != None:
+        #child process: run a single case
+        size, format_name = options.case.split(":")
+        result = run_case(int(size), format_name, options.repeat)
+        sys.stdout.write(json.dumps(result))
+        return
+
+    cases = []
+    for size in options.sizes.split(","):
+        for format_name in options.formats.split(","):
+            p = subprocess.Popen([sys.executable, os.path.abspath(__file__), \
+                                    "--case", "%s:%s" % (size, format_name), \
+                                    "--repeat", str(options.repeat)], \
+                                    stdout=subprocess.PIPE)
+            out = p.communicate()[0]
+            if p.returncode != 0:
+                sys.exit("case %s/%s failed" % (size, format_name))
+            cases.append(json.loads(out))
+            sys.stderr.write("%s/%s done\n" % (size, format_name))
+
+    report = {"revision": get_revision(),
+                "python": sys.version.split()[0],
+                "timestamp": time.time(),
+                "cases": cases}
+    data = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        f = open(options.output, "w")
+        f.write(data)
+        f.close()
+    else:
+        sys.stdout.write(data + "\n")
+
+
+if __name__ == "__main__":
+    main()
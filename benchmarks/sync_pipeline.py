@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       sync_pipeline.py
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""
+Runs the whole sync pipeline offline, against a local directory and against
+the HTTP stand-in (see http_standin.py), and reports the duration and the
+transferred bytes of every phase for a first sync, a sync without changes
+and a sync after a small local change.
+
+Usage: python benchmarks/sync_pipeline.py [--size 10000] [--latency 0.02]
+"""
+import json
+import optparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from simple_db_bench import Task, make_database, diverge
+from http_standin import StandInServer
+from simple_db.database import DataBase, STORAGE_FORMAT_COMPACT
+import sync_core
+import sync_trace
+import transports
+
+
+def run(transport, base, tmp_dir):
+    local_file = os.path.join(tmp_dir, "local.xml")
+    shutil.copy(base, local_file)
+    db = DataBase(local_file, Task)
+    db.add_sync_source("remote")
+    history = sync_trace.SyncHistory(os.path.join(tmp_dir, "history"))
+    results = {}
+    for name in ["first", "unchanged", "changed"]:
+        if name == "changed":
+            diverge(db, random.Random(0), "local", 0.001)
+        sync_core.sync_with_transport(db, Task, transport, history=history, \
+                                        source_id="remote")
+        entry = history.last()
+        results[name] = {"duration": entry["duration"],
+                            "bytes": entry["bytes"],
+                            "phases": dict((p["name"], p["duration"]) \
+                                            for p in entry["phases"])}
+    return results
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--size", type="int", default=10000)
+    parser.add_option("--latency", type="float", default=0.02)
+    options, args = parser.parse_args()
+    tmp_dir = tempfile.mkdtemp(prefix="sync_pipeline")
+    try:
+        base = os.path.join(tmp_dir, "base.xml")
+        make_database(base, options.size, STORAGE_FORMAT_COMPACT)
+        report = {"size": options.size, "latency": options.latency}
+
+        remote_dir = os.path.join(tmp_dir, "remote")
+        os.mkdir(remote_dir)
+        report["local"] = run(transports.LocalTransport(remote_dir), base, \
+                                os.path.join(tmp_dir))
+        sys.stderr.write("local done\n")
+
+        server = StandInServer(latency=options.latency)
+        server.start()
+        for name in os.listdir(tmp_dir):
+            if name.startswith("local.xml"):
+                os.remove(os.path.join(tmp_dir, name))
+        report["http"] = run(transports.WebDAVTransport(server.get_url()), \
+                                base, tmp_dir)
+        report["http"]["requests"] = server.requests
+        server.shutdown()
+        sys.stderr.write("http done\n")
+    finally:
+        shutil.rmtree(tmp_dir)
+    sys.stdout.write(json.dumps(report, indent=2, sort_keys=True) + "\n")
+
+
+if __name__ == "__main__":
+    main()
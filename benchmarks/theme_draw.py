@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       theme_draw.py
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""
+Measures background draw calls per second with and without the cached
+background surface of theme.ThemeInfo.
+
+Usage: python benchmarks/theme_draw.py [theme name] [seconds]
+"""
+import os
+import sys
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+import cairo
+import theme
+
+
+def draws_per_second(draw, seconds):
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 400, 500)
+    n = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        ctx = cairo.Context(surface)
+        ctx.scale(1.5, 1.5)
+        draw(ctx, 200, 250, 1.5)
+        n += 1
+    return n / (time.time() - start)
+    
+    
+def main():
+    name = "BlackRound"
+    seconds = 2.0
+    if len(sys.argv) > 1:
+        name = sys.argv[1]
+    if len(sys.argv) > 2:
+        seconds = float(sys.argv[2])
+    info = theme.ThemeInfo(os.path.join(SRC_DIR, "themes", name, "theme.conf"))
+    uncached = draws_per_second(info.render_background, seconds)
+    cached = draws_per_second(info.draw_background, seconds)
+    print "theme:    %s" % name
+    print "uncached: %.0f draws/s" % uncached
+    print "cached:   %.0f draws/s" % cached
+    print "speedup:  %.1fx" % (cached / uncached)
+
+
+if __name__ == "__main__":
+    main()
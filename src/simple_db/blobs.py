@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       blobs.py
+#       
+#       Copyright 2010 Sven Festersen <sven@sven-festersen.de>
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""
+Keeps large field values out of the database file. The fields listed in
+blob_fields of a prototype are written to a content-addressed BlobStore
+next to the database once they are longer than BLOB_THRESHOLD characters,
+the database file only holds their hash. The values are read from the
+store when they are accessed. The tokens of every value are recorded in
+the file tokens of the store when it is written, so a TokenIndex is built
+without reading the blobs.
+
+Blobs are never deleted. A value that no object of the database refers to
+any more may still be needed by removed objects, the archive, another
+database sharing the store or the cached copy of a remote, so unused
+blobs are not collected.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+
+from errors import ErrorUnknownBlob
+
+#values up to this many characters stay in the database file
+BLOB_THRESHOLD = 256
+#the tokens of the blobs, one JSON list [hash, tokens] per line
+TOKENS_FILE = "tokens"
+
+_HASH_RE = re.compile("^[0-9a-f]{40}$")
+
+
+def get_blob_directory(filename):
+    """
+    Returns the directory of the blob store of the database in filename.
+    """
+    return filename + ".blobs"
+    
+def get_hash(data):
+    return hashlib.sha1(data).hexdigest()
+    
+    
+class BlobRef(object):
+    """
+    The value of a field whose data is kept in a BlobStore.
+    """
+    
+    __slots__ = ["hash"]
+    
+    def __init__(self, hash):
+        self.hash = str(hash)
+        
+    def __eq__(self, other):
+        return isinstance(other, BlobRef) and other.hash == self.hash
+        
+    def __ne__(self, other):
+        return not self.__eq__(other)
+        
+    def __hash__(self):
+        return hash(self.hash)
+        
+    def __repr__(self):
+        return "BlobRef(%r)" % self.hash
+        
+        
+class BlobStore(object):
+    """
+    Stores values in files named by the SHA-1 hash of their UTF-8
+    encoding in directory. A file is never changed once it is written, so
+    databases can share a store and values with a known hash never have to
+    be transferred again.
+    """
+    
+    def __init__(self, directory):
+        super(BlobStore, self).__init__()
+        self.directory = directory
+        #the tokens read from TOKENS_FILE by hash and how far it was read
+        self._tokens = {}
+        self._tokens_read = 0
+        self._tokens_lock = threading.Lock()
+        
+    def _get_path(self, hash):
+        #hashes come from database files, which may come from a remote
+        if _HASH_RE.match(hash) == None:
+            raise ErrorUnknownBlob(hash)
+        return os.path.join(self.directory, hash)
+        
+    def has(self, hash):
+        return os.path.exists(self._get_path(hash))
+        
+    def put(self, value):
+        """
+        Stores the str or unicode value and returns its BlobRef.
+        """
+        if isinstance(value, unicode):
+            value = value.encode("utf-8")
+        hash = get_hash(value)
+        if not self.has(hash):
+            self.put_data(hash, value)
+        return BlobRef(hash)
+        
+    def put_data(self, hash, data):
+        """
+        Stores data received for hash, e.g. by a sync. Raises
+        ErrorUnknownBlob if data does not match hash.
+        """
+        path = self._get_path(hash)
+        if get_hash(data) != hash:
+            raise ErrorUnknownBlob(hash)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        #write a temporary file first, readers never see a partial blob
+        fd, tmp_path = tempfile.mkstemp(".tmp", hash, self.directory)
+        f = os.fdopen(fd, "wb")
+        f.write(data)
+        f.close()
+        os.rename(tmp_path, path)
+        #the data is at hand now, later it would have to be read again
+        self._add_tokens(hash, data)
+        
+    def get_data(self, hash):
+        try:
+            f = open(self._get_path(hash), "rb")
+        except IOError:
+            raise ErrorUnknownBlob(hash)
+        try:
+            return f.read()
+        finally:
+            f.close()
+            
+    def get(self, ref):
+        """
+        Returns the value of a BlobRef, as str if it is plain ascii.
+        """
+        data = self.get_data(ref.hash)
+        try:
+            data.decode("ascii")
+            return data
+        except UnicodeError:
+            return data.decode("utf-8")
+            
+    def get_tokens(self, ref):
+        """
+        Returns the tokens (see simple_db.index.tokenize) of the value of a
+        BlobRef as a frozenset. They are only computed from the blob if none
+        were recorded for it, e.g. because it was stored by an older version.
+        """
+        self._tokens_lock.acquire()
+        try:
+            tokens = self._tokens.get(ref.hash)
+            if tokens == None:
+                #another process may have recorded them meanwhile
+                self._read_tokens()
+                tokens = self._tokens.get(ref.hash)
+        finally:
+            self._tokens_lock.release()
+        if tokens == None:
+            tokens = self._add_tokens(ref.hash, self.get_data(ref.hash))
+        return tokens
+        
+    def _read_tokens(self):
+        #the file is only appended to, so only new lines are read
+        try:
+            f = open(os.path.join(self.directory, TOKENS_FILE), "rb")
+        except IOError:
+            return
+        try:
+            f.seek(self._tokens_read)
+            for line in f:
+                if not line.endswith("\n"):
+                    #still being written
+                    break
+                self._tokens_read += len(line)
+                try:
+                    hash, tokens = json.loads(line)
+                except ValueError:
+                    continue
+                self._tokens[str(hash)] = frozenset(tokens)
+        finally:
+            f.close()
+            
+    def _add_tokens(self, hash, data):
+        from index import tokenize
+        tokens = frozenset(tokenize(data))
+        self._tokens_lock.acquire()
+        try:
+            self._tokens[hash] = tokens
+            try:
+                f = open(os.path.join(self.directory, TOKENS_FILE), "ab")
+                try:
+                    f.write(json.dumps([hash, sorted(tokens)]) + "\n")
+                finally:
+                    f.close()
+            except IOError:
+                #they are computed again next time
+                pass
+        finally:
+            self._tokens_lock.release()
+        return tokens
+        
+    def externalize(self, obj):
+        """
+        Moves the long values of the blob fields of obj to the store. The
+        values are replaced by their BlobRef without changing the
+        modification time of the fields.
+        """
+        from dataobject import DataField
+        for fid in obj.blob_fields:
+            field = obj.fields[fid]
+            value = field.value
+            if isinstance(value, basestring) and len(value) > BLOB_THRESHOLD:
+                ref = self.put(value)
+                field._lock.acquire()
+                try:
+                    #keep a value that was set while this one was stored
+                    if field.value is value:
+                        super(DataField, field).__setattr__("value", ref)
+                finally:
+                    field._lock.release()
+                
+    def resolve(self, obj):
+        """
+        Replaces the BlobRefs in the blob fields of obj by their values, for
+        objects that don't belong to a database.
+        """
+        from dataobject import DataField
+        for fid in obj.blob_fields:
+            field = obj.fields[fid]
+            if isinstance(field.value, BlobRef):
+                super(DataField, field).__setattr__("value", self.get(field.value))
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       changes.py
+#       
+#       Copyright 2010 Sven Festersen <sven@sven-festersen.de>
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+
+
+class ChangeSet(object):
+    """
+    The changes made to a database in one transaction, i.e. while its write
+    lock was held.
+    
+    added and removed map ids to objects, changed maps ids to dicts that map
+    field names to (old_value, new_value). Changes are coalesced: an object
+    that was added and removed again does not show up at all, changes to
+    fields of added objects are not reported and a field that was changed
+    more than once is reported once with its first old and its last new
+    value. An object that was replaced shows up as removed and added, so
+    removed should be applied before added.
+    """
+    
+    def __init__(self):
+        super(ChangeSet, self).__init__()
+        self.added = {}
+        self.removed = {}
+        self.changed = {}
+        
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.changed)
+        
+    def object_added(self, obj):
+        self.added[obj.id] = obj
+        
+    def object_removed(self, obj):
+        if obj.id in self.added:
+            del self.added[obj.id]
+        else:
+            self.removed[obj.id] = obj
+        if obj.id in self.changed:
+            del self.changed[obj.id]
+            
+    def field_changed(self, obj, field, old_value, new_value):
+        if obj.id in self.added:
+            return
+        fields = self.changed.setdefault(obj.id, {})
+        if field in fields:
+            old_value = fields[field][0]
+        fields[field] = (old_value, new_value)
@@ -22,14 +22,40 @@
 import os
 from xml.dom.minidom import parseString
 
+import sys
 import threading
 import time
+import uuid
+from blobs import BlobRef, BlobStore, get_blob_directory
+from changes import ChangeSet
 import dataobject
 from errors import *
+import loader
+from rwlock import ReadWriteLock
+from stats import Stats, TimedLock
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 STORAGE_FORMAT_NORMAL = 0
 STORAGE_FORMAT_COMPACT = 1
+#compact files of at least this many bytes are parsed by a pool of
+#PARALLEL_LOAD_PROCESSES processes (None means one per cpu)
+PARALLEL_LOAD_THRESHOLD = 8 * 1024 * 1024
+PARALLEL_LOAD_PROCESSES = None
+
 
+def get_file_stamp(filename):
+    """
+    Returns (mtime, size, inode) of a file or None if it does not exist.
+    """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size, st.st_ino)
 
 def getText(nodelist):
     """
@@ -48,10 +74,32 @@ def convert_type(t, value):
                     "int": int,
                     "float": float,
                     "bool": lambda x: x != "False",
-                    "unicode": unicode}
+                    "unicode": unicode,
+                    "blob": BlobRef}
     if t in conversions:
         return conversions[t](value)
     return str(value)
+    
+    
+def parse_object_compact(prototype, obj_node):
+    """
+    Creates an object from an <o> node of the compact storage format.
+    """
+    id = obj_node.getAttribute("id")
+    created = float(obj_node.getAttribute("tc"))
+    modified = float(obj_node.getAttribute("tm"))
+    obj = prototype(id, created, modified)
+    field_node_list = obj_node.getElementsByTagName("f")
+    for field_node in field_node_list:
+        fid = field_node.getAttribute("id")
+        ftype = field_node.getAttribute("t")
+        modified = float(field_node.getAttribute("tm"))
+        value = getText(field_node.childNodes)
+        value = convert_type(ftype, value)
+        obj[fid] = value
+        super(dataobject.DataField, obj.field(fid)).__setattr__("modified", modified)
+    obj.creation_finished = True
+    return obj
                     
 
 
@@ -96,57 +144,203 @@ class DataBase(object):
     _version = "beta1"
     filename = None
     prototype = None
+    #incremented on every change of objects or tombstones
+    revision = 0
     
-    def __init__(self, filename, prototype):
-        self._lock = threading.Lock()
+    def __init__(self, filename, prototype, stats=False, load=True):
+        self._lock = ReadWriteLock()
+        self._commit_lock = threading.Lock()
+        self._stats = None
         self._data = {}
         self._sync_sources = {}
+        self._indexes = []
+        self._subscribers = []
+        self._pending = ChangeSet()
+        self._changes_lock = threading.Lock()
+        self._archived = set()
+        self._tombstones = {}
+        self._file_stamp = None
+        self._known_ids = set()
         self.storage_format = STORAGE_FORMAT_COMPACT
+        #identifies the database in the sync sources of other databases
+        self.id = uuid.uuid4().hex
         super(DataBase, self).__init__()
         super(DataBase, self).__setattr__("filename", filename)
+        self.archive_filename = filename + ".archive"
+        #long values of the blob fields of prototype, see simple_db.blobs
+        self.blobs = BlobStore(get_blob_directory(filename))
         super(DataBase, self).__setattr__("prototype", prototype)
-        self._load()
+        if stats:
+            self.enable_stats()
+        if load:
+            self._load()
+        
+    def enable_stats(self):
+        """
+        Starts recording operation timings and lock wait times. This should
+        be done before the database is used by more than one thread. As long
+        as stats are disabled the only overhead is one attribute check per
+        operation.
+        """
+        if self._stats == None:
+            self._stats = Stats()
+            self._lock = TimedLock(self._lock, self._stats)
+            
+    def disable_stats(self):
+        if self._stats != None:
+            self._lock = self._lock.lock
+            self._stats = None
+            
+    def stats(self):
+        """
+        Returns the recorded stats as a dict mapping operation names to their
+        count, total time, mean, maximum and latency histogram. Returns an
+        empty dict if stats are disabled.
+        """
+        if self._stats == None:
+            return {}
+        return self._stats.as_dict()
         
     def _load(self):
+        stats = self._stats
+        if stats != None: start = time.time()
+        lock_file = self._lock_file(False)
+        try:
+            self._parse_file()
+            self._file_stamp = get_file_stamp(self.filename)
+            self._known_ids = set(self._data)
+        finally:
+            self._unlock_file(lock_file)
+            if stats != None: stats.record("load", time.time() - start)
+            
+    def _lock_file(self, exclusive):
+        """
+        Takes an advisory lock on filename.lock that keeps other processes
+        from writing the database file while it is read or written. Returns
+        the lock file or None if locking is not possible.
+        """
+        if fcntl == None:
+            return None
+        try:
+            lock_file = open(self.filename + ".lock", "a")
+        except IOError:
+            return None
+        if exclusive:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        else:
+            fcntl.flock(lock_file, fcntl.LOCK_SH)
+        return lock_file
+        
+    def _unlock_file(self, lock_file):
+        if lock_file != None:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+            
+    def reload(self):
+        """
+        Merges the changes other processes committed to the database file
+        since it was loaded or committed by this database. Only changed
+        objects are touched. Returns the lists (added, removed, changed) of
+        affected ids.
+        """
+        self._commit_lock.acquire()
+        try:
+            lock_file = self._lock_file(False)
+            try:
+                if get_file_stamp(self.filename) == self._file_stamp:
+                    return ([], [], [])
+                return self._merge_file()
+            finally:
+                self._unlock_file(lock_file)
+        finally:
+            self._commit_lock.release()
+            
+    def _merge_file(self):
+        """
+        Reads the database file and merges it into the database. The caller
+        has to hold the commit lock and the file lock.
+        """
+        stamp = get_file_stamp(self.filename)
+        disk = DataBase(self.filename, self.prototype, load=False)
+        disk._parse_file()
+        added = []
+        removed = []
+        changed = []
+        self._lock.acquire_write()
+        try:
+            for id, disk_obj in disk._data.iteritems():
+                obj = self._data.get(id)
+                if obj == None:
+                    #only add it if it was not deleted here
+                    if not id in self._known_ids and not id in self._archived:
+                        self._add(disk_obj.copy())
+                        added.append(id)
+                elif merge_object(obj, disk_obj):
+                    changed.append(id)
+            for id in self._data.keys():
+                #known but gone from the file, deleted by another process
+                if id in self._known_ids and not id in disk._data:
+                    self._remove(id)
+                    removed.append(id)
+            self._archived |= disk._archived
+            _merge_tombstones(self, disk._tombstones)
+            for id, last_sync in disk._sync_sources.iteritems():
+                if last_sync > self._sync_sources.get(id, -1):
+                    self._sync_sources[id] = last_sync
+            self._known_ids = set(disk._data)
+            self._file_stamp = stamp
+        finally:
+            self._release_write()
+        return (added, removed, changed)
+        
+    def _parse_file(self):
         try:
             if not os.path.exists(self.filename): return
             f = open(self.filename, "r")
             data = f.read()
             if data.endswith("</database>"): self.storage_format = STORAGE_FORMAT_NORMAL
             f.close()
+            if self.storage_format == STORAGE_FORMAT_COMPACT and \
+                    len(data) >= PARALLEL_LOAD_THRESHOLD and loader.available():
+                result = loader.parse_compact_parallel(self.prototype, data, \
+                                                    PARALLEL_LOAD_PROCESSES)
+                if result != None:
+                    header_node, objs = result
+                    self._parse_header_compact(header_node)
+                    for obj in objs:
+                        obj.database = self
+                        self._data[obj.id] = obj
+                    return
             dom = parseString(data)
             if self.storage_format == STORAGE_FORMAT_COMPACT:
                 main_node = dom.getElementsByTagName("db")[0]
-                #load sync sources
-                sync_node_list = main_node.getElementsByTagName("sy")[0].getElementsByTagName("s")
-                for sync_node in sync_node_list:
-                    self._sync_sources[sync_node.getAttribute("id")] = float(sync_node.getAttribute("ls"))
+                self._parse_header_compact(main_node)
                 
                 #load objects
                 obj_node_list = main_node.getElementsByTagName("o")
                 for obj_node in obj_node_list:
-                    id = obj_node.getAttribute("id")
-                    created = float(obj_node.getAttribute("tc"))
-                    modified = float(obj_node.getAttribute("tm"))
-                    obj = self.prototype(id, created, modified)
-                    field_node_list = obj_node.getElementsByTagName("f")
-                    for field_node in field_node_list:
-                        fid = field_node.getAttribute("id")
-                        ftype = field_node.getAttribute("t")
-                        modified = float(field_node.getAttribute("tm"))
-                        value = getText(field_node.childNodes)
-                        value = convert_type(ftype, value)
-                        obj[fid] = value
-                        super(dataobject.DataField, obj.field(fid)).__setattr__("modified", modified)
-                    obj.creation_finished = True
-                    self._data[id] = obj
+                    obj = parse_object_compact(self.prototype, obj_node)
+                    obj.database = self
+                    self._data[obj.id] = obj
             else:
                 main_node = dom.getElementsByTagName("database")[0]
+                if main_node.getAttribute("id") != "":
+                    self.id = main_node.getAttribute("id")
                 #load sync sources
                 sync_node_list = main_node.getElementsByTagName("sync")[0].getElementsByTagName("source")
                 for sync_node in sync_node_list:
                     self._sync_sources[sync_node.getAttribute("id")] = float(sync_node.getAttribute("lastSync"))
                 
+                #load archived ids
+                for archive_node in main_node.getElementsByTagName("archive"):
+                    for node in archive_node.getElementsByTagName("archived"):
+                        self._archived.add(node.getAttribute("id"))
+                        
+                #load tombstones
+                for tombstones_node in main_node.getElementsByTagName("tombstones"):
+                    for node in tombstones_node.getElementsByTagName("tombstone"):
+                        self._tombstones[node.getAttribute("id")] = float(node.getAttribute("deleted"))
+                
                 #load objects
                 obj_node_list = main_node.getElementsByTagName("object")
                 for obj_node in obj_node_list:
@@ -164,146 +358,699 @@ class DataBase(object):
                         obj[fid] = value
                         super(dataobject.DataField, obj.field(fid)).__setattr__("modified", modified)
                     obj.creation_finished = True
+                    obj.database = self
                     self._data[id] = obj
         except:
             raise ErrorUnableToReadFile
         
+    def _parse_header_compact(self, main_node):
+        """
+        Reads the id, sync sources, archived ids and tombstones from the <db>
+        node of the compact storage format.
+        """
+        if main_node.getAttribute("id") != "":
+            self.id = main_node.getAttribute("id")
+        #load sync sources
+        sync_node_list = main_node.getElementsByTagName("sy")[0].getElementsByTagName("s")
+        for sync_node in sync_node_list:
+            self._sync_sources[sync_node.getAttribute("id")] = float(sync_node.getAttribute("ls"))
+        
+        #load archived ids
+        for archive_node in main_node.getElementsByTagName("ar"):
+            for node in archive_node.getElementsByTagName("a"):
+                self._archived.add(node.getAttribute("id"))
+                
+        #load tombstones
+        for tombstones_node in main_node.getElementsByTagName("ts"):
+            for node in tombstones_node.getElementsByTagName("t"):
+                self._tombstones[node.getAttribute("id")] = float(node.getAttribute("d"))
+        
     def __setattr__(self, name, value):
         if name == "filename":
             raise ErrorReadOnly
         super(DataBase, self).__setattr__(name, value)
         
     def __len__(self):
-        return len(self._data)
+        self._lock.acquire_read()
+        n = len(self._data)
+        self._lock.release_read()
+        return n
         
     def __delitem__(self, id):
-        if id in self._data:
-            self._lock.acquire()
-            del self._data[id]
-            self._lock.release()
-        else:
-            raise ErrorUnknownDataObject
+        stats = self._stats
+        if stats != None: start = time.time()
+        self._lock.acquire_write()
+        try:
+            if not id in self._data:
+                raise ErrorUnknownDataObject
+            self._delete(id, time.time())
+        finally:
+            self._release_write()
+        if stats != None: stats.record("delete", time.time() - start)
+            
+    def read(self, func, *args):
+        """
+        Calls func with args while holding the read lock and returns its
+        result, so that func sees the objects and the indexes in one state
+        while other threads, e.g. a sync, change the database.
+        """
+        self._lock.acquire_read()
+        try:
+            return func(*args)
+        finally:
+            self._lock.release_read()
             
     def __getitem__(self, id):
-        if id in self._data:
-            return self._data[id]
-        else:
+        self._lock.acquire_read()
+        obj = self._data.get(id)
+        self._lock.release_read()
+        if obj == None:
             raise ErrorUnknownDataObject
+        return obj
             
     def __setitem__(self, id, obj):
         self.add(obj)
         
     def __contains__(self, id):
-        return id in self._data
+        self._lock.acquire_read()
+        result = id in self._data
+        self._lock.release_read()
+        return result
             
     def add(self, obj):
-        self._lock.acquire()
+        stats = self._stats
+        if stats != None: start = time.time()
+        self._lock.acquire_write()
+        try:
+            self._add(obj)
+        finally:
+            self._release_write()
+        if stats != None: stats.record("add", time.time() - start)
+        
+    def _add(self, obj):
+        if obj.id in self._data:
+            old_obj = self._data[obj.id]
+            self._detach(old_obj)
+            self._object_removed(old_obj)
         self._data[obj.id] = obj
         obj.creation_finished = True
-        self._lock.release()
+        obj.database = self
+        self._object_added(obj)
+        
+    def _remove(self, id):
+        obj = self._data.pop(id)
+        self._detach(obj)
+        self._object_removed(obj)
+        
+    def _detach(self, obj):
+        #removed objects, e.g. in a ChangeSet, can still read their blobs
+        obj.blobs = self.blobs
+        obj.database = None
+        
+    def _delete(self, id, deleted):
+        """
+        Removes an object and leaves a tombstone, so that the deletion
+        reaches other databases on sync.
+        """
+        self._remove(id)
+        self._tombstones[id] = deleted
+        self.revision += 1
+        
+    def add_many(self, objs):
+        """
+        Adds all objects in objs while holding the lock only once. If
+        iterating objs raises an exception, e.g. while parsing them, the
+        objects added so far are removed again and replaced objects are
+        restored before it is passed on.
+        """
+        stats = self._stats
+        if stats != None: start = time.time()
+        self._lock.acquire_write()
+        try:
+            #(id, replaced object or None) of every added object
+            added = []
+            try:
+                for obj in objs:
+                    added.append((obj.id, self._data.get(obj.id)))
+                    self._add(obj)
+            except:
+                exc_info = sys.exc_info()
+                for id, old_obj in reversed(added):
+                    if old_obj == None:
+                        self._remove(id)
+                    else:
+                        self._add(old_obj)
+                raise exc_info[0], exc_info[1], exc_info[2]
+        finally:
+            self._release_write()
+        if stats != None: stats.record("add_many", time.time() - start)
+        
+    def delete_many(self, ids):
+        """
+        Deletes the objects with the given ids while holding the lock only
+        once. Nothing is deleted if one of the ids is unknown.
+        """
+        stats = self._stats
+        if stats != None: start = time.time()
+        self._lock.acquire_write()
+        try:
+            for id in ids:
+                if not id in self._data:
+                    raise ErrorUnknownDataObject
+            deleted = time.time()
+            for id in ids:
+                self._delete(id, deleted)
+        finally:
+            self._release_write()
+        if stats != None: stats.record("delete_many", time.time() - start)
+        
+    def update_many(self, ids, field, value):
+        """
+        Sets field to value for all objects with the given ids while holding
+        the lock only once. All changed fields get the same modification time.
+        If value is callable it is called with the old value of each object
+        and the result is used as the new value. Nothing is changed if one of
+        the ids or the field is unknown or value raises an exception.
+        """
+        stats = self._stats
+        if stats != None: start = time.time()
+        self._lock.acquire_write()
+        try:
+            #all new values first, so a failure leaves every object alone
+            updates = []
+            for id in ids:
+                if not id in self._data:
+                    raise ErrorUnknownDataObject
+                data_field = self._data[id].field(field)
+                if callable(value):
+                    updates.append((data_field, value(data_field.value)))
+                else:
+                    updates.append((data_field, value))
+            modified = time.time()
+            for data_field, new_value in updates:
+                data_field.update(new_value, modified)
+        finally:
+            self._release_write()
+        if stats != None: stats.record("update_many", time.time() - start)
+        
+    def apply(self, objs, deleted_ids):
+        """
+        Merges the objects in objs field by field, the newer field wins, and
+        deletes the objects with the given ids while holding the lock only
+        once. Unknown objects are added unless they are archived. Returns the
+        lists (added, removed, changed) of affected ids.
+        """
+        added = []
+        removed = []
+        changed = []
+        self._lock.acquire_write()
+        try:
+            for other in objs:
+                obj = self._data.get(other.id)
+                if obj == None:
+                    if not other.id in self._archived:
+                        self._add(other)
+                        added.append(other.id)
+                elif merge_object(obj, other):
+                    changed.append(other.id)
+            deleted = time.time()
+            for id in deleted_ids:
+                if id in self._data:
+                    self._delete(id, deleted)
+                    removed.append(id)
+        finally:
+            self._release_write()
+        return (added, removed, changed)
+        
+    def archive(self, ids):
+        """
+        Moves the objects with the given ids to the append-only archive file
+        archive_filename. Archived objects are not treated as deleted when
+        syncing. The database has to be committed afterwards.
+        """
+        self._lock.acquire_write()
+        try:
+            for id in ids:
+                if not id in self._data:
+                    raise ErrorUnknownDataObject
+            for id in ids:
+                self.blobs.externalize(self._data[id])
+            records = "".join([self._data[id].get_xml_compact() + "\n" \
+                                for id in ids])
+            if isinstance(records, unicode):
+                #non-ascii unicode fields, like in commit()
+                records = records.encode("utf-8")
+            f = open(self.archive_filename, "a")
+            f.write(records)
+            f.close()
+            for id in ids:
+                self._remove(id)
+                self._archived.add(id)
+        finally:
+            self._release_write()
+            
+    def is_archived(self, id):
+        self._lock.acquire_read()
+        result = id in self._archived
+        self._lock.release_read()
+        return result
+            
+    def load_archive(self):
+        """
+        Reads the archive file and returns the archived objects as a
+        QueryResult. Objects that were restored by a sync are skipped. If an
+        object was archived more than once the most recent record wins.
+        """
+        result = {}
+        if os.path.exists(self.archive_filename):
+            f = open(self.archive_filename, "r")
+            try:
+                for line in f:
+                    line = line.strip()
+                    if line == "":
+                        continue
+                    dom = parseString(line)
+                    obj = parse_object_compact(self.prototype, dom.documentElement)
+                    self.blobs.resolve(obj)
+                    if obj.id in self._archived:
+                        result[obj.id] = obj
+            except:
+                raise ErrorUnableToReadFile
+            finally:
+                f.close()
+        return QueryResult(result, lambda x, y: 0)
+        
+    def add_index(self, index):
+        """
+        Adds an index (see simple_db.index) that is kept up to date on every
+        change of the database.
+        """
+        self._lock.acquire_write()
+        try:
+            index.rebuild(self._data.itervalues())
+            self._indexes.append(index)
+            index.database = self
+        finally:
+            self._release_write()
+        
+    def remove_index(self, index):
+        self._lock.acquire_write()
+        try:
+            self._indexes.remove(index)
+            index.database = None
+        finally:
+            self._release_write()
+        
+    def subscribe(self, callback, dispatch=None):
+        """
+        Calls callback with a ChangeSet (see simple_db.changes) after every
+        transaction that changed the database, i.e. when the outermost write
+        lock is released. If dispatch is given it is called with callback
+        and the change set instead, e.g. gobject.idle_add to deliver the
+        changes on the GTK main loop. Returns the subscription to pass to
+        unsubscribe().
+        """
+        subscription = (callback, dispatch)
+        self._changes_lock.acquire()
+        self._subscribers = self._subscribers + [subscription]
+        self._changes_lock.release()
+        return subscription
+        
+    def unsubscribe(self, subscription):
+        self._changes_lock.acquire()
+        try:
+            subscribers = self._subscribers[:]
+            subscribers.remove(subscription)
+            self._subscribers = subscribers
+        finally:
+            self._changes_lock.release()
+            
+    def _release_write(self):
+        """
+        Releases the write lock and publishes the recorded changes if it was
+        the outermost write lock of this thread.
+        """
+        if self._lock.release_write() and len(self._subscribers) > 0:
+            self._changes_lock.acquire()
+            changes = self._pending
+            self._pending = ChangeSet()
+            subscribers = self._subscribers
+            self._changes_lock.release()
+            if len(changes) == 0:
+                return
+            for callback, dispatch in subscribers:
+                if dispatch == None:
+                    callback(changes)
+                else:
+                    dispatch(callback, changes)
+                    
+    def _object_added(self, obj):
+        self.revision += 1
+        for index in self._indexes:
+            index.object_added(obj)
+        if len(self._subscribers) > 0:
+            self._changes_lock.acquire()
+            self._pending.object_added(obj)
+            self._changes_lock.release()
+            
+    def _object_removed(self, obj):
+        self.revision += 1
+        for index in self._indexes:
+            index.object_removed(obj)
+        if len(self._subscribers) > 0:
+            self._changes_lock.acquire()
+            self._pending.object_removed(obj)
+            self._changes_lock.release()
+            
+    def _field_changed(self, obj, field, old_value, new_value):
+        #the field holds the write lock while the value changes
+        self._lock.acquire_write()
+        try:
+            self.revision += 1
+            for index in self._indexes:
+                index.field_changed(obj, field, old_value, new_value)
+            if len(self._subscribers) > 0:
+                self._changes_lock.acquire()
+                self._pending.field_changed(obj, field, old_value, new_value)
+                self._changes_lock.release()
+        finally:
+            self._release_write()
         
     def commit(self):
-        self._lock.acquire()
-        xml = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        stats = self._stats
+        if stats != None: start = time.time()
+        #readers may go on while the database is serialized, the commit lock
+        #only keeps concurrent commits from writing the file at the same time
+        self._commit_lock.acquire()
+        lock_file = self._lock_file(True)
+        try:
+            #merge what other processes committed in the meantime
+            if get_file_stamp(self.filename) != self._file_stamp and \
+                    os.path.exists(self.filename):
+                self._merge_file()
+            self._lock.acquire_read()
+            try:
+                xml = self._serialize()
+                known_ids = set(self._data)
+            finally:
+                self._lock.release_read()
+            if stats != None:
+                serialized = time.time()
+                stats.record("commit.serialize", serialized - start)
+            #write a temporary file first, so that the file is replaced
+            #atomically
+            tmp_filename = self.filename + ".tmp"
+            if isinstance(xml, unicode):
+                #non-ascii unicode fields
+                xml = xml.encode("utf-8")
+            f = open(tmp_filename, "w")
+            f.write(xml)
+            f.close()
+            os.rename(tmp_filename, self.filename)
+            self._file_stamp = get_file_stamp(self.filename)
+            self._known_ids = known_ids
+        finally:
+            self._unlock_file(lock_file)
+            self._commit_lock.release()
+        if stats != None:
+            end = time.time()
+            stats.record("commit.write", end - serialized)
+            stats.record("commit", end - start)
+            
+    def _serialize(self):
+        xml = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?>']
         if self.storage_format == STORAGE_FORMAT_COMPACT:
-            xml += '<db v="%s">' % self._version
+            xml.append('<db v="%s" id="%s">' % (self._version, self.id))
             #write sync sources
-            xml += '<sy>'
+            xml.append('<sy>')
             for id, last_sync in self._sync_sources.iteritems():
-                xml += '<s id="%s" ls="%s" />' % (id, last_sync)
-            xml += '</sy>'
-            #write objects
+                xml.append('<s id="%s" ls="%s" />' % (id, last_sync))
+            xml.append('</sy>')
+            #write archived ids
+            xml.append('<ar>')
+            for id in self._archived:
+                xml.append('<a id="%s" />' % id)
+            xml.append('</ar>')
+            #write tombstones
+            xml.append('<ts>')
+            for id, deleted in self._tombstones.iteritems():
+                xml.append('<t id="%s" d="%s" />' % (id, deleted))
+            xml.append('</ts>')
+            #write objects, long values of blob fields go to the blob store
+            blob_fields = self.prototype.blob_fields
             for id, obj in self._data.iteritems():
-                xml += obj.get_xml_compact()
-            xml += '</db>'
+                if blob_fields:
+                    self.blobs.externalize(obj)
+                xml.append(obj.get_xml_compact())
+            xml.append('</db>')
         else:
-            xml += '\n<database version="%s">\n' % self._version
-             #write sync sources
-            xml += '\t<sync>\n'
+            xml.append('\n<database version="%s" id="%s">\n' % (self._version, self.id))
+            #write sync sources
+            xml.append('\t<sync>\n')
             for id, last_sync in self._sync_sources.iteritems():
-                xml += '\t\t<source id="%s" lastSync="%s" />\n' % (id, last_sync)
-            xml += '\t</sync>\n'
-            #write objects
+                xml.append('\t\t<source id="%s" lastSync="%s" />\n' % (id, last_sync))
+            xml.append('\t</sync>\n')
+            #write archived ids
+            xml.append('\t<archive>\n')
+            for id in self._archived:
+                xml.append('\t\t<archived id="%s" />\n' % id)
+            xml.append('\t</archive>\n')
+            #write tombstones
+            xml.append('\t<tombstones>\n')
+            for id, deleted in self._tombstones.iteritems():
+                xml.append('\t\t<tombstone id="%s" deleted="%s" />\n' % (id, deleted))
+            xml.append('\t</tombstones>\n')
+            #write objects, long values of blob fields go to the blob store
+            blob_fields = self.prototype.blob_fields
             for id, obj in self._data.iteritems():
-                xml += obj.get_xml()
-            xml += '</database>'
-            
-        f = open(self.filename, "w")
-        f.write(xml)
-        f.close()
-        self._lock.release()
+                if blob_fields:
+                    self.blobs.externalize(obj)
+                xml.append(obj.get_xml())
+            xml.append('</database>')
+        return "".join(xml)
         
     def query(self, select_func=lambda x: x, sort_func=lambda x, y: 0):
-        result_keys = filter(lambda x: select_func(self._data[x]), self._data.keys())
-        result = {}
-        for id in result_keys:
-            result[id] = self._data[id]
+        stats = self._stats
+        if stats != None: start = time.time()
+        self._lock.acquire_read()
+        try:
+            result = {}
+            for id, obj in self._data.iteritems():
+                if select_func(obj):
+                    result[id] = obj
+        finally:
+            self._lock.release_read()
             
-        return QueryResult(result, sort_func)
+        if stats == None:
+            return QueryResult(result, sort_func)
+        filtered = time.time()
+        query_result = QueryResult(result, sort_func)
+        end = time.time()
+        stats.record("query.filter", filtered - start)
+        stats.record("query.sort", end - filtered)
+        stats.record("query", end - start)
+        return query_result
         
     def sync(self, source_id, source):
-        if not source_id in self._sync_sources:
-            raise ErrorUnknownSyncSource
-        else:
-            sync_databases(self, source, self._sync_sources[source_id], self._lock)
-            self._sync_sources[source_id] = time.time()
+        stats = self._stats
+        if stats != None: start = time.time()
+        self._lock.acquire_write()
+        try:
+            if not source_id in self._sync_sources:
+                raise ErrorUnknownSyncSource
+            sync_databases(self, source, self._sync_sources[source_id])
+            now = time.time()
+            self._sync_sources[source_id] = now
+            self._collect_tombstones()
+            #register in the sync sources of source, so that it keeps its
+            #tombstones until this database has seen them
+            source._lock.acquire_write()
+            try:
+                source._sync_sources[self.id] = now
+                source._collect_tombstones()
+            finally:
+                source._release_write()
+        finally:
+            self._release_write()
+        if stats != None: stats.record("sync", time.time() - start)
+        
+    def _collect_tombstones(self):
+        """
+        Drops the tombstones that all sync sources have seen. The caller has
+        to hold the write lock.
+        """
+        if len(self._sync_sources) == 0:
+            return
+        cutoff = min(self._sync_sources.values())
+        for id, deleted in self._tombstones.items():
+            if deleted < cutoff:
+                del self._tombstones[id]
+                self.revision += 1
             
+    def get_blob_hashes(self):
+        """
+        Returns the set of hashes of the blobs the objects refer to. Values
+        that are not committed yet are not included.
+        """
+        blob_fields = self.prototype.blob_fields
+        hashes = set()
+        self._lock.acquire_read()
+        try:
+            for obj in self._data.itervalues():
+                for fid in blob_fields:
+                    value = obj.fields[fid].value
+                    if type(value) is BlobRef:
+                        hashes.add(value.hash)
+        finally:
+            self._lock.release_read()
+        return hashes
+        
     def add_sync_source(self, id):
-        self._lock.acquire()
+        self._lock.acquire_write()
         self._sync_sources[id] = -1
-        self._lock.release()
+        self._release_write()
         
     def has_sync_source(self, id):
-        return id in self._sync_sources
+        self._lock.acquire_read()
+        result = id in self._sync_sources
+        self._lock.release_read()
+        return result
         
     def remove_sync_source(self, id):
-        if not source_id in self._sync_sources:
-            raise ErrorUnknownSyncSource
-        else:
-            self._lock.acquire()
+        self._lock.acquire_write()
+        try:
+            if not id in self._sync_sources:
+                raise ErrorUnknownSyncSource
             del self._sync_sources[id]
-            self._lock.release()
+        finally:
+            self._release_write()
         
         
-def sync_databases(local, remote, last_sync, lock):
-    lock.acquire()
-    in_both = local.query(lambda x: x.id in remote)
-    in_local_only = local.query(lambda x: not x.id in remote)
-    in_remote_only = remote.query(lambda x: not x.id in local)
+def merge_object(obj, other):
+    """
+    Copies every field of other that is newer than the same field of obj,
+    an object with the same id. Returns True if a field was copied.
+    """
+    if obj.modified == other.modified:
+        return False
+    updated = False
+    for fid, field in other:
+        if field.modified > obj.field(fid).modified:
+            obj.field(fid).replace(field)
+            updated = True
+    if other.modified > obj.modified:
+        super(dataobject.DataObject, obj).__setattr__("modified", other.modified)
+    return updated
+    
     
-    for local_obj in in_both:
-        remote_obj = remote[local_obj.id]
-        if local_obj.modified != remote_obj.modified:
-            for id, field in local_obj:
+def sync_databases(local, remote, last_sync):
+    """
+    Syncs local and remote. Both databases are write locked for the whole
+    sync, local first.
+    """
+    local._lock.acquire_write()
+    try:
+        remote._lock.acquire_write()
+        try:
+            _sync_databases(local, remote, last_sync)
+            _copy_blobs(remote, local)
+            _copy_blobs(local, remote)
+        finally:
+            remote._release_write()
+    finally:
+        local._release_write()
+        
+        
+def _copy_blobs(source, target):
+    """
+    Copies the blobs the objects of target refer to from the blob store of
+    source if the store of target lacks them, e.g. after a sync of
+    databases with different stores.
+    """
+    if source.blobs.directory == target.blobs.directory:
+        return
+    blob_fields = target.prototype.blob_fields
+    for obj in target._data.itervalues():
+        for fid in blob_fields:
+            value = obj.fields[fid].value
+            if type(value) is BlobRef and not target.blobs.has(value.hash) \
+                    and source.blobs.has(value.hash):
+                target.blobs.put_data(value.hash, \
+                                        source.blobs.get_data(value.hash))
+                
+                
+def _merge_tombstones(db, tombstones):
+    for id, deleted in tombstones.iteritems():
+        if deleted > db._tombstones.get(id, -1):
+            db._tombstones[id] = deleted
+            db.revision += 1
+            
+            
+def _apply_tombstones(source, target):
+    """
+    Deletes the objects of target that have a tombstone in source and copies
+    the tombstones. An object that was changed after its deletion wins and
+    the tombstone is dropped.
+    """
+    for id, deleted in source._tombstones.items():
+        obj = target._data.get(id)
+        if obj != None:
+            if obj.modified > deleted:
+                del source._tombstones[id]
+                source.revision += 1
+                continue
+            target._remove(id)
+        if deleted > target._tombstones.get(id, -1):
+            target._tombstones[id] = deleted
+            target.revision += 1
+            
+            
+def _sync_databases(local, remote, last_sync):
+    #deletions only cost a look at the tombstones
+    _apply_tombstones(remote, local)
+    _apply_tombstones(local, remote)
+    
+    local_data = local._data
+    remote_data = remote._data
+    in_local_only = []
+    for id, local_obj in local_data.items():
+        remote_obj = remote_data.get(id)
+        if remote_obj == None:
+            in_local_only.append(local_obj)
+        elif local_obj.modified != remote_obj.modified:
+            for fid, field in local_obj:
                 local_modified = field.modified
-                remote_modified = remote_obj.field(id).modified
+                remote_modified = remote_obj.field(fid).modified
                 if local_modified > remote_modified:
-                    remote_obj.field(id).replace(local_obj.field(id))
-                    #remote_obj[id] = local_obj[id]
+                    remote_obj.field(fid).replace(field)
                 elif local_modified < remote_modified:
-                    local_obj.field(id).replace(remote_obj.field(id))
-                    #local_obj[id] = remote_obj[id]
+                    field.replace(remote_obj.field(fid))
+            #both hold the newest fields now, a copy that kept the older
+            #time would be skipped by the check above when synced with a
+            #third database that still has the old fields
+            modified = max(local_obj.modified, remote_obj.modified)
+            super(dataobject.DataObject, local_obj).__setattr__("modified", \
+                                                                modified)
+            super(dataobject.DataObject, remote_obj).__setattr__("modified", \
+                                                                modified)
+    in_remote_only = [remote_obj for id, remote_obj in remote_data.items() \
+                        if not id in local_data]
     
-    lock.release()
-    
-    local_delete = []
+    #objects on one side only are new unless they were archived
     for local_obj in in_local_only:
-        local_modified = local_obj.modified
-        if local_modified > last_sync:
-            remote.add(local_obj)
-        elif local_modified < last_sync:
-            local_delete.append(local_obj.id)
+        if local_obj.id in remote._archived:
+            #archived remotely, only bring it back if it was changed locally
+            if local_obj.modified > last_sync:
+                remote._archived.discard(local_obj.id)
+                remote._add(local_obj.copy())
+        else:
+            remote._add(local_obj.copy())
             
-    remote_delete = []
     for remote_obj in in_remote_only:
-        remote_modified = remote_obj.modified
-        if remote_modified > last_sync:
-            local.add(remote_obj)
-        elif remote_modified < last_sync:
-            remote_delete.append(remote_obj.id)
-            
-    for id in local_delete: del local[id]
-    for id in remote_delete: del remote[id]
-    
-    
-
+        if remote_obj.id in local._archived:
+            #archived locally, only bring it back if it was changed remotely
+            if remote_obj.modified > last_sync:
+                local._archived.discard(remote_obj.id)
+                local._add(remote_obj.copy())
+        else:
+            local._add(remote_obj.copy())
@@ -22,51 +22,132 @@
 import threading
 import time
 from xml.sax.saxutils import escape
+from blobs import BlobRef
 from errors import *
 
 
+def normalize_value(value):
+    """
+    Returns a str value that is not plain ascii as unicode, it is taken to
+    be UTF-8 (e.g. the text of a GTK widget). The database writes such text
+    as unicode, so a mix of str and unicode values could not be written.
+    """
+    if type(value) is str:
+        try:
+            value.decode("ascii")
+        except UnicodeError:
+            return value.decode("utf-8", "replace")
+    return value
+    
+    
 class DataField(object):
     
     modified = 0
     value = None
     data_object = None
+    name = None
     
     def __init__(self, value="", modified=0):
-        self._lock = threading.Lock()
+        super(DataField, self).__setattr__("_lock", threading.Lock())
         super(DataField, self).__init__()
-        super(DataField, self).__setattr__("value", value)
+        super(DataField, self).__setattr__("value", normalize_value(value))
         super(DataField, self).__setattr__("modified", modified)
         
     def __setattr__(self, name, value):
-        if name != "_lock": self._lock.acquire()
-        if name == "value":
-            if self.data_object.creation_finished:
+        if name == "modified":
+            raise ErrorReadOnly
+        if name != "value":
+            super(DataField, self).__setattr__(name, value)
+            return
+        value = normalize_value(value)
+        database = self._lock_database()
+        try:
+            self._lock.acquire()
+            old_value = self.value
+            obj = self.data_object
+            if obj != None and obj.creation_finished:
                 super(DataField, self).__setattr__("modified", time.time())
-            if self.data_object != None:
-                if self.data_object.creation_finished:
-                    super(DataObject, self.data_object).__setattr__("modified", self.modified)
-                    self.data_object.needs_commit = True
-        elif name == "modified":
+                super(DataObject, obj).__setattr__("modified", self.modified)
+                obj.needs_commit = True
+            super(DataField, self).__setattr__("value", value)
             self._lock.release()
-            raise ErrorReadOnly
-        super(DataField, self).__setattr__(name, value)
-        if name != "_lock": self._lock.release()
+            self._notify(old_value)
+        finally:
+            self._unlock_database(database)
+            
+    def _lock_database(self):
+        """
+        Acquires the write lock of the database the field belongs to, so the
+        value changes together with the indexes and is not changed while the
+        database is read, e.g. by a commit. Returns the database for
+        _unlock_database or None if the field doesn't belong to one.
+        """
+        obj = self.data_object
+        if obj == None or obj.database == None:
+            return None
+        database = obj.database
+        database._lock.acquire_write()
+        return database
+        
+    def _unlock_database(self, database):
+        if database != None:
+            database._release_write()
+            
+    def _notify(self, old_value):
+        obj = self.data_object
+        if obj != None and obj.creation_finished and obj.database != None:
+            obj.database._field_changed(obj, self.name, old_value, self.value)
+        
+    def update(self, value, modified):
+        """
+        Sets the value with the given modification time and marks the data
+        object as modified.
+        """
+        value = normalize_value(value)
+        database = self._lock_database()
+        try:
+            self._lock.acquire()
+            old_value = self.value
+            super(DataField, self).__setattr__("value", value)
+            super(DataField, self).__setattr__("modified", modified)
+            obj = self.data_object
+            if obj != None and obj.creation_finished:
+                super(DataObject, obj).__setattr__("modified", modified)
+                obj.needs_commit = True
+            self._lock.release()
+            self._notify(old_value)
+        finally:
+            self._unlock_database(database)
         
     def get_xml(self, id):
         val = self.value
-        if type(val) == str:
+        t = type(val).__name__
+        if isinstance(val, basestring):
             val = escape(val)
-        return '\t\t<field id="%s" type="%s" modified="%s">%s</field>\n' % (id, type(self.value).__name__, self.modified, val)
+        elif isinstance(val, BlobRef):
+            t, val = "blob", val.hash
+        return '\t\t<field id="%s" type="%s" modified="%s">%s</field>\n' % (id, t, self.modified, val)
         
     def get_xml_compact(self, id):
         val = self.value
-        if type(val) == str:
+        t = type(val).__name__
+        if isinstance(val, basestring):
             val = escape(val)
-        return '<f id="%s" t="%s" tm="%s">%s</f>' % (id, type(self.value).__name__, self.modified, val)
+        elif isinstance(val, BlobRef):
+            t, val = "blob", val.hash
+        return '<f id="%s" t="%s" tm="%s">%s</f>' % (id, t, self.modified, val)
         
     def replace(self, obj):
-        super(DataField, self).__setattr__("value", obj.value)
-        super(DataField, self).__setattr__("modified", obj.modified)
+        database = self._lock_database()
+        try:
+            self._lock.acquire()
+            old_value = self.value
+            super(DataField, self).__setattr__("value", obj.value)
+            super(DataField, self).__setattr__("modified", obj.modified)
+            self._lock.release()
+            self._notify(old_value)
+        finally:
+            self._unlock_database(database)
 
 
 class DataObject(object):
@@ -75,8 +156,13 @@ class DataObject(object):
     modified = 0
     created = 0
     fields = {}
+    #fields whose long values are kept in the blob store of the database
+    blob_fields = []
     needs_commit = False
     creation_finished = False
+    database = None
+    #the blob store of the database the object was removed from
+    blobs = None
     
     def __init__(self, id, created=time.time(), modified=time.time()):
         super(DataObject, self).__init__()
@@ -90,8 +176,10 @@ class DataObject(object):
                 nfields[id] = DataField()
             super(DataObject, self).__setattr__("fields", nfields)
         
+        #a new field isn't shared yet, so its lock is not needed
         for id, field in self.fields.iteritems():
-            field.data_object = self
+            super(DataField, field).__setattr__("data_object", self)
+            super(DataField, field).__setattr__("name", id)
         
     def __setattr__(self, name, value):
         if name in ["modified", "created", "fields"]:
@@ -102,7 +190,14 @@ class DataObject(object):
             
     def __getitem__(self, field_name):
         if field_name in self.fields:
-            return self.fields[field_name].value
+            value = self.fields[field_name].value
+            if type(value) is BlobRef:
+                #out of line values are only read when they are used
+                blobs = self.get_blobs()
+                if blobs == None:
+                    raise ErrorUnknownBlob(value.hash)
+                return blobs.get(value)
+            return value
         else:
             raise ErrorUnknownField
             
@@ -116,6 +211,26 @@ class DataObject(object):
         for id, field in self.fields.iteritems():
             yield (id, field)
             
+    def copy(self):
+        """
+        Returns a copy of the object that does not belong to any database.
+        """
+        obj = self.__class__(self.id, self.created, self.modified)
+        for id, field in self:
+            obj.field(id).replace(field)
+        obj.blobs = self.get_blobs()
+        return obj
+        
+    def get_blobs(self):
+        """
+        Returns the BlobStore the values of the blob fields are read from or
+        None if the object never belonged to a database.
+        """
+        database = self.database
+        if database != None:
+            return database.blobs
+        return self.blobs
+            
     def field(self, field_name):
         if field_name in self.fields:
             return self.fields[field_name]
@@ -123,15 +238,15 @@ class DataObject(object):
             raise ErrorUnknownField
             
     def get_xml(self):
-        xml = '\t<object id="%s" created="%s" modified="%s">\n' % (self.id, self.created, self.modified)
+        xml = ['\t<object id="%s" created="%s" modified="%s">\n' % (self.id, self.created, self.modified)]
         for id, field in self.fields.iteritems():
-            xml += field.get_xml(id)
-        xml += '\t</object>\n'
-        return xml
+            xml.append(field.get_xml(id))
+        xml.append('\t</object>\n')
+        return "".join(xml)
         
     def get_xml_compact(self):
-        xml = '<o id="%s" tc="%s" tm="%s">' % (self.id, self.created, self.modified)
+        xml = ['<o id="%s" tc="%s" tm="%s">' % (self.id, self.created, self.modified)]
         for id, field in self.fields.iteritems():
-            xml += field.get_xml_compact(id)
-        xml += '</o>'
-        return xml
+            xml.append(field.get_xml_compact(id))
+        xml.append('</o>')
+        return "".join(xml)
@@ -42,3 +42,7 @@ class ErrorUnknownDataObject(Error):
     
 class ErrorUnknownSyncSource(Error):
     pass
+    
+    
+class ErrorUnknownBlob(Error):
+    pass
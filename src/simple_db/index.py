@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       index.py
+#       
+#       Copyright 2010 Sven Festersen <sven@sven-festersen.de>
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+import bisect
+import re
+
+from blobs import BlobRef
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(value):
+    """
+    Splits a field value into a set of lower case unicode tokens.
+    """
+    if type(value) == str:
+        value = value.decode("utf-8", "replace")
+    elif type(value) != unicode:
+        value = unicode(value)
+    return set(TOKEN_RE.findall(value.lower()))
+
+
+class Index(object):
+    """
+    Base class for indexes. An index is added to a database with
+    DataBase.add_index and gets notified of every added or removed object
+    and every changed field. The lookups hold the read lock of the database
+    and return copies, so they can be used while other threads change it.
+    """
+    
+    #the database the index was added to
+    database = None
+    
+    def _read(self, func, *args):
+        db = self.database
+        if db == None:
+            return func(*args)
+        return db.read(func, *args)
+    
+    def rebuild(self, objects):
+        self.clear()
+        for obj in objects:
+            self.object_added(obj)
+    
+    def clear(self):
+        pass
+        
+    def object_added(self, obj):
+        pass
+        
+    def object_removed(self, obj):
+        pass
+        
+    def field_changed(self, obj, field, old_value, new_value):
+        pass
+
+
+class TokenIndex(Index):
+    """
+    An inverted index that maps the tokens of the given fields to the ids of
+    the objects containing them. search() matches every query token as a
+    prefix, so it can be used for search-as-you-type. Values kept in a blob
+    store are indexed by the tokens the store recorded for them.
+    """
+    
+    def __init__(self, fields):
+        super(TokenIndex, self).__init__()
+        self.fields = fields
+        self.clear()
+        
+    def clear(self):
+        self._postings = {}
+        self._tokens = []
+        self._object_tokens = {}
+        
+    def _get_tokens(self, obj):
+        tokens = set()
+        for field in self.fields:
+            value = obj.field(field).value
+            blobs = obj.get_blobs()
+            if type(value) is BlobRef and blobs != None:
+                #the blob itself is not read
+                tokens |= blobs.get_tokens(value)
+            else:
+                tokens |= tokenize(obj[field])
+        return tokens
+        
+    def _add_token(self, token, id):
+        if not token in self._postings:
+            self._postings[token] = set()
+            bisect.insort(self._tokens, token)
+        self._postings[token].add(id)
+        
+    def _remove_token(self, token, id):
+        ids = self._postings[token]
+        ids.discard(id)
+        if len(ids) == 0:
+            del self._postings[token]
+            del self._tokens[bisect.bisect_left(self._tokens, token)]
+        
+    def object_added(self, obj):
+        tokens = self._get_tokens(obj)
+        self._object_tokens[obj.id] = tokens
+        for token in tokens:
+            self._add_token(token, obj.id)
+            
+    def object_removed(self, obj):
+        tokens = self._object_tokens.pop(obj.id, set())
+        for token in tokens:
+            self._remove_token(token, obj.id)
+            
+    def field_changed(self, obj, field, old_value, new_value):
+        if not field in self.fields:
+            return
+        old_tokens = self._object_tokens.get(obj.id, set())
+        new_tokens = self._get_tokens(obj)
+        self._object_tokens[obj.id] = new_tokens
+        for token in old_tokens - new_tokens:
+            self._remove_token(token, obj.id)
+        for token in new_tokens - old_tokens:
+            self._add_token(token, obj.id)
+            
+    def _token_range(self, prefix):
+        start = bisect.bisect_left(self._tokens, prefix)
+        end = bisect.bisect_left(self._tokens, prefix + u"\uffff")
+        return (start, end)
+        
+    def prefix_lookup(self, prefix):
+        """
+        Returns the set of ids of all objects with a token starting with
+        prefix.
+        """
+        return self._read(self._prefix_lookup, prefix)
+        
+    def _prefix_lookup(self, prefix):
+        start, end = self._token_range(prefix)
+        result = set()
+        for token in self._tokens[start:end]:
+            result |= self._postings[token]
+        return result
+        
+    def search(self, text):
+        """
+        Returns the set of ids of all objects that contain every token of
+        text as a prefix of one of their tokens. Returns None if text has no
+        tokens at all.
+        """
+        return self._read(self._search, text)
+        
+    def _search(self, text):
+        ranges = []
+        for token in tokenize(text):
+            start, end = self._token_range(token)
+            ranges.append((end - start, token))
+        if len(ranges) == 0:
+            return None
+        #start with the prefix that matches the fewest tokens
+        ranges.sort()
+        result = self._prefix_lookup(ranges[0][1])
+        for n, token in ranges[1:]:
+            if len(result) == 0:
+                break
+            if n > len(result):
+                #cheaper to check the tokens of the remaining objects
+                result = set([id for id in result \
+                                if self._has_prefix(id, token)])
+            else:
+                result &= self._prefix_lookup(token)
+        return result
+        
+    def _has_prefix(self, id, prefix):
+        for token in self._object_tokens[id]:
+            if token.startswith(prefix):
+                return True
+        return False
+        
+        
+class FieldIndex(Index):
+    """
+    Maps the values of a field to the set of ids of the objects having that
+    value.
+    """
+    
+    def __init__(self, field):
+        super(FieldIndex, self).__init__()
+        self.field = field
+        self.clear()
+        
+    def clear(self):
+        self._ids = {}
+        self._values = {}
+        
+    def _add(self, id, value):
+        self._values[id] = value
+        if not value in self._ids:
+            self._ids[value] = set()
+        self._ids[value].add(id)
+        
+    def _remove(self, id):
+        value = self._values.pop(id)
+        ids = self._ids[value]
+        ids.discard(id)
+        if len(ids) == 0:
+            del self._ids[value]
+        
+    def object_added(self, obj):
+        self._add(obj.id, obj[self.field])
+        
+    def object_removed(self, obj):
+        if obj.id in self._values:
+            self._remove(obj.id)
+            
+    def field_changed(self, obj, field, old_value, new_value):
+        if field == self.field:
+            self._remove(obj.id)
+            self._add(obj.id, new_value)
+            
+    def lookup(self, value):
+        """
+        Returns the set of ids of all objects with the given value.
+        """
+        return self._read(self._lookup, value)
+        
+    def _lookup(self, value):
+        return set(self._ids.get(value, ()))
+        
+        
+class SortedFieldIndex(Index):
+    """
+    Keeps the ids of all objects sorted by the value of a field, which makes
+    range lookups possible. If select_func is given only the objects it
+    returns True for are indexed, it is called again whenever a field of an
+    object changed.
+    """
+    
+    def __init__(self, field, select_func=None):
+        super(SortedFieldIndex, self).__init__()
+        self.field = field
+        self.select_func = select_func
+        self.clear()
+        
+    def clear(self):
+        self._entries = []
+        self._values = {}
+        
+    def rebuild(self, objects):
+        self.clear()
+        for obj in objects:
+            if self._selects(obj):
+                self._values[obj.id] = obj[self.field]
+        self._entries = [(value, id) for id, value in self._values.iteritems()]
+        self._entries.sort()
+        
+    def _selects(self, obj):
+        return self.select_func == None or self.select_func(obj)
+        
+    def _add(self, id, value):
+        self._values[id] = value
+        bisect.insort(self._entries, (value, id))
+        
+    def _remove(self, id):
+        entry = (self._values.pop(id), id)
+        del self._entries[bisect.bisect_left(self._entries, entry)]
+        
+    def object_added(self, obj):
+        if self._selects(obj):
+            self._add(obj.id, obj[self.field])
+        
+    def object_removed(self, obj):
+        if obj.id in self._values:
+            self._remove(obj.id)
+            
+    def field_changed(self, obj, field, old_value, new_value):
+        if field != self.field:
+            #other fields only matter if they decide whether obj is indexed
+            if self.select_func == None or \
+                    self.select_func(obj) == (obj.id in self._values):
+                return
+        if obj.id in self._values:
+            self._remove(obj.id)
+        if self._selects(obj):
+            self._add(obj.id, obj[self.field])
+            
+    def range(self, low, high):
+        """
+        Returns the set of ids of all objects with low <= value < high.
+        """
+        return self._read(self._range, low, high)
+        
+    def _range(self, low, high):
+        start = bisect.bisect_left(self._entries, (low, ))
+        end = bisect.bisect_left(self._entries, (high, ))
+        return set([id for value, id in self._entries[start:end]])
+        
+    def iter_from(self, low):
+        """
+        Yields (value, id) for all objects with low <= value in ascending
+        order. The caller has to hold the read lock of the database while
+        it iterates, see DataBase.read.
+        """
+        i = bisect.bisect_left(self._entries, (low, ))
+        while i < len(self._entries):
+            yield self._entries[i]
+            i += 1
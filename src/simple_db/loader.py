@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       loader.py
+#       
+#       Copyright 2010 Sven Festersen <sven@sven-festersen.de>
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""
+Parses large database files of the compact storage format in parallel. The
+objects are split into chunks at <o> boundaries, the chunks are parsed by a
+multiprocessing pool and the objects are built in the calling process.
+"""
+from xml.dom.minidom import parseString
+
+import dataobject
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+    
+    
+def available():
+    return multiprocessing != None and multiprocessing.cpu_count() > 1
+    
+def split_compact(data, n):
+    """
+    Splits the data of a compact database file into the header (everything
+    before the first object) and at most n chunks of complete objects.
+    Returns None if there are no objects.
+    """
+    start = data.find('<o id="')
+    end = data.rfind('</db>')
+    if start == -1 or end == -1:
+        return None
+    chunks = []
+    size = (end - start) / n + 1
+    pos = start
+    while pos < end:
+        next_pos = data.find('<o id="', pos + size, end)
+        if next_pos == -1:
+            next_pos = end
+        chunks.append(data[pos:next_pos])
+        pos = next_pos
+    return (data[:start], chunks)
+    
+def _parse_chunk(chunk):
+    """
+    Parses a chunk of objects into plain tuples, DataObjects can't be
+    pickled.
+    """
+    from database import getText, convert_type
+    objs = []
+    dom = parseString("<c>%s</c>" % chunk)
+    for obj_node in dom.documentElement.getElementsByTagName("o"):
+        fields = []
+        for field_node in obj_node.getElementsByTagName("f"):
+            value = convert_type(field_node.getAttribute("t"), \
+                                    getText(field_node.childNodes))
+            fields.append((field_node.getAttribute("id"), value, \
+                            float(field_node.getAttribute("tm"))))
+        objs.append((obj_node.getAttribute("id"), \
+                        float(obj_node.getAttribute("tc")), \
+                        float(obj_node.getAttribute("tm")), fields))
+    dom.unlink()
+    return objs
+    
+def parse_compact_parallel(prototype, data, processes=None):
+    """
+    Parses the data of a compact database file with a pool of processes
+    (one per cpu by default). Returns the <db> node without the objects and
+    the list of objects or None if the data can't be split.
+    """
+    if processes == None:
+        processes = multiprocessing.cpu_count()
+    parts = split_compact(data, processes * 4)
+    if parts == None:
+        return None
+    header, chunks = parts
+    header_node = parseString(header + "</db>").documentElement
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_parse_chunk, chunks)
+    finally:
+        pool.close()
+        pool.join()
+        
+    objs = []
+    for result in results:
+        for id, created, modified, fields in result:
+            obj = prototype(id, created, modified)
+            for fid, value, field_modified in fields:
+                field = obj.field(fid)
+                super(dataobject.DataField, field).__setattr__("value", value)
+                super(dataobject.DataField, field).__setattr__("modified", \
+                                                            field_modified)
+            obj.creation_finished = True
+            objs.append(obj)
+    return (header_node, objs)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       rwlock.py
+#       
+#       Copyright 2010 Sven Festersen <sven@sven-festersen.de>
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+import thread
+import threading
+
+
+class ReadWriteLock(object):
+    """
+    A lock that can be held by any number of readers or by one writer.
+    Waiting writers block new readers, so writers can't starve. Both read and
+    write locks are reentrant for the thread holding them and the writer may
+    also acquire the read lock. Upgrading a read lock to a write lock is not
+    possible.
+    """
+    
+    def __init__(self):
+        super(ReadWriteLock, self).__init__()
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = {}
+        self._writer = None
+        self._write_count = 0
+        self._waiting_writers = 0
+        
+    def acquire_read(self):
+        me = thread.get_ident()
+        self._cond.acquire()
+        try:
+            if self._writer != me and not me in self._readers:
+                while self._writer != None or self._waiting_writers > 0:
+                    self._cond.wait()
+            self._readers[me] = self._readers.get(me, 0) + 1
+        finally:
+            self._cond.release()
+            
+    def release_read(self):
+        me = thread.get_ident()
+        self._cond.acquire()
+        try:
+            count = self._readers[me] - 1
+            if count == 0:
+                del self._readers[me]
+                if len(self._readers) == 0:
+                    self._cond.notifyAll()
+            else:
+                self._readers[me] = count
+        finally:
+            self._cond.release()
+            
+    def acquire_write(self):
+        me = thread.get_ident()
+        self._cond.acquire()
+        try:
+            if self._writer == me:
+                self._write_count += 1
+                return
+            if me in self._readers:
+                raise RuntimeError("can't upgrade a read lock")
+            self._waiting_writers += 1
+            while self._writer != None or len(self._readers) > 0:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = me
+            self._write_count = 1
+        finally:
+            self._cond.release()
+            
+    def release_write(self):
+        """
+        Returns True if the lock was released by the outermost holder.
+        """
+        self._cond.acquire()
+        try:
+            if self._writer != thread.get_ident():
+                raise RuntimeError("write lock not held")
+            self._write_count -= 1
+            if self._write_count == 0:
+                self._writer = None
+                self._cond.notifyAll()
+                return True
+            return False
+        finally:
+            self._cond.release()
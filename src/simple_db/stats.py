@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       stats.py
+#       
+#       Copyright 2010 Sven Festersen <sven@sven-festersen.de>
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+import threading
+import time
+
+#upper bounds of the latency histogram buckets in seconds, the last bucket
+#counts everything slower than the last bound
+HISTOGRAM_BOUNDS = [0.0001, 0.001, 0.01, 0.1, 1.0, 10.0]
+
+
+class OperationStats(object):
+    """
+    Count, total time, maximum and latency histogram of one operation.
+    """
+    
+    def __init__(self):
+        super(OperationStats, self).__init__()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        
+    def record(self, duration):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        i = 0
+        while i < len(HISTOGRAM_BOUNDS) and duration > HISTOGRAM_BOUNDS[i]:
+            i += 1
+        self.histogram[i] += 1
+        
+    def as_dict(self):
+        mean = 0.0
+        if self.count > 0:
+            mean = self.total / self.count
+        return {"count": self.count, "total": self.total, "mean": mean,
+                "max": self.max, "histogram": list(self.histogram)}
+
+
+class Stats(object):
+    """
+    Collects OperationStats by operation name.
+    """
+    
+    def __init__(self):
+        super(Stats, self).__init__()
+        self._lock = threading.Lock()
+        self._operations = {}
+        
+    def record(self, name, duration):
+        self._lock.acquire()
+        if not name in self._operations:
+            self._operations[name] = OperationStats()
+        self._operations[name].record(duration)
+        self._lock.release()
+        
+    def as_dict(self):
+        self._lock.acquire()
+        result = {"histogram_bounds": list(HISTOGRAM_BOUNDS)}
+        for name, operation in self._operations.iteritems():
+            result[name] = operation.as_dict()
+        self._lock.release()
+        return result
+        
+        
+class TimedLock(object):
+    """
+    Wraps a ReadWriteLock and records the time spent waiting for it as
+    'lock_wait.read' and 'lock_wait.write'.
+    """
+    
+    def __init__(self, lock, stats):
+        super(TimedLock, self).__init__()
+        self.lock = lock
+        self._stats = stats
+        
+    def acquire_read(self):
+        start = time.time()
+        self.lock.acquire_read()
+        self._stats.record("lock_wait.read", time.time() - start)
+        
+    def release_read(self):
+        self.lock.release_read()
+        
+    def acquire_write(self):
+        start = time.time()
+        self.lock.acquire_write()
+        self._stats.record("lock_wait.write", time.time() - start)
+        
+    def release_write(self):
+        return self.lock.release_write()
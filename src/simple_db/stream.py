@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       stream.py
+#       
+#       Copyright 2010 Sven Festersen <sven@sven-festersen.de>
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""
+Reads the objects of a database file one at a time without loading the
+whole database, e.g. to export a large database with constant memory use.
+Both storage formats are supported.
+"""
+import os
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
+from blobs import BlobStore, get_blob_directory
+import dataobject
+from errors import ErrorUnableToReadFile
+
+#tag and attribute names of objects and fields in the compact and in the
+#normal storage format
+OBJECT_TAGS = {"o": ("tc", "tm", "f", "t", "tm"),
+                "object": ("created", "modified", "field", "type", "modified")}
+
+
+def iter_objects(filename, prototype):
+    """
+    Yields the objects stored in filename as instances of prototype. The
+    objects don't belong to a database, so values in the blob store are read
+    right away. A missing file has no objects.
+    Raises ErrorUnableToReadFile if the file can't be parsed.
+    """
+    from database import convert_type
+    if not os.path.exists(filename):
+        return
+    blobs = BlobStore(get_blob_directory(filename))
+    try:
+        root = None
+        for event, elem in ElementTree.iterparse(filename, ("start", "end")):
+            if root == None:
+                root = elem
+            if event != "end" or not elem.tag in OBJECT_TAGS:
+                continue
+            created, modified, field_tag, type_attr, field_modified = \
+                                                        OBJECT_TAGS[elem.tag]
+            obj = prototype(elem.get("id"), float(elem.get(created)), \
+                            float(elem.get(modified)))
+            for field_node in elem.findall(field_tag):
+                field = obj.field(field_node.get("id"))
+                value = convert_type(field_node.get(type_attr), \
+                                        field_node.text or "")
+                super(dataobject.DataField, field).__setattr__("value", value)
+                super(dataobject.DataField, field).__setattr__("modified", \
+                                        float(field_node.get(field_modified)))
+            obj.creation_finished = True
+            blobs.resolve(obj)
+            #drop the parsed objects, only the current one is kept
+            root.clear()
+            yield obj
+    except (SyntaxError, ValueError, TypeError):
+        raise ErrorUnableToReadFile
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       watcher.py
+#       
+#       Copyright 2010 Sven Festersen <sven@sven-festersen.de>
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+import os
+import threading
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+    
+from database import get_file_stamp
+
+
+class FileWatcher(object):
+    """
+    Calls callback from a background thread whenever filename changes on
+    disk. inotify is used through pyinotify if it is installed, otherwise
+    the file is polled every interval seconds.
+    """
+    
+    def __init__(self, filename, callback, interval=2.0):
+        super(FileWatcher, self).__init__()
+        self.filename = os.path.abspath(filename)
+        self.callback = callback
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._notifier = None
+        
+    def start(self):
+        if pyinotify != None:
+            self._start_inotify()
+        else:
+            self._thread = threading.Thread(target=self._poll)
+            self._thread.setDaemon(True)
+            self._thread.start()
+            
+    def stop(self):
+        self._stop.set()
+        if self._notifier != None:
+            self._notifier.stop()
+            self._notifier = None
+            
+    def _start_inotify(self):
+        watcher = self
+        
+        class Handler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                if event.pathname == watcher.filename:
+                    watcher.callback()
+                    
+        wm = pyinotify.WatchManager()
+        self._notifier = pyinotify.ThreadedNotifier(wm, Handler())
+        self._notifier.setDaemon(True)
+        self._notifier.start()
+        #watch the directory, commits replace the file by renaming
+        wm.add_watch(os.path.dirname(self.filename), \
+                        pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO)
+        
+    def _poll(self):
+        stamp = get_file_stamp(self.filename)
+        while not self._stop.isSet():
+            self._stop.wait(self.interval)
+            new_stamp = get_file_stamp(self.filename)
+            if new_stamp != stamp:
+                stamp = new_stamp
+                self.callback()
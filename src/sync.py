@@ -19,13 +19,14 @@
 #       along with this program; if not, write to the Free Software
 #       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 #       MA 02110-1301, USA.
-import ftplib
 import gobject
 import gtk
 import pygtk
 import threading
 
-from simple_db.database import DataBase
+import sync_core
+import task_daemon
+import transports
 
 
 class ErrorDialog(gtk.Dialog):
@@ -116,125 +117,12 @@ def show_force_error_dialog(msg, cb_again, cb_force):
     gtk.gdk.threads_leave()
 
 
-def stor_callback(data):
-    f = open("/tmp/.task_db.xml", "ab")
-    f.write(data)
-    f.close()
-    
-
-def sync_tasks(local_db, prototype, ftp_server, ftp_username, ftp_password, \
-                ftp_dir, cb_finish, force):
-    """
-    This function downloads a task db file from the given ftp server and syncs
-    it with the local db.
-    """
-    #1. connect
-    try:
-        ftp = ftplib.FTP(ftp_server, ftp_username, ftp_password)
-    except:
-        show_error_dialog("Can't connect to host <i>%s</i>.\nPlease check your \
-                            connection settings." % ftp_server)
-        return False
-        
-    #2. change to ftp_dir
-    try:
-        ftp.cwd(ftp_dir)
-    except:
-        ftp.quit()
-        show_error_dialog("It seems the directory <i>%s</i>\ndoes not exists \
-                            on the server." % ftp_dir)
-        return False
-        
-    #3. check whether sync lock can be acquired
-    files = ftp.nlst()
-    if ".task-lock" in files and not force:
-        #can't acquire lock
-        def try_again():
-            t = SyncThread(local_db, prototype, ftp_server, ftp_username, \
-                            ftp_password, ftp_dir, cb_finish)
-            t.start()
-        def force():
-            t = SyncThread(local_db, prototype, ftp_server, ftp_username, \
-                            ftp_password, ftp_dir, cb_finish, True)
-            t.start()
-        show_force_error_dialog("Can't acquire an exclusive lock on the remote \
-                                    data.\nEither another application is using \
-                                    the data\nor a previous synchronization \
-                                    attempt failed.\n\nYou can retry or force \
-                                    the sync. Forcing it may result in data \
-                                    loss!\nClick Ok to abort.", try_again, \
-                                    force)
-        ftp.quit()
-        return False
-    
-    #4. acquire lock
-    try:
-        f = open("/dev/null", "r")
-        ftp.storlines("STOR .task-lock", f)
-        f.close()
-    except:
-        ftp.quit()
-        show_error_dialog("Error writing data to server. Please check \
-                            permissions.")
-        return False
-    
-    #5. download database file if it exists
-    if ".task_db.xml" in files:
-        f = open("/tmp/.task_db.xml", "w")
-        f.write("")
-        f.close()
-        try:
-            ftp.retrbinary("RETR .task_db.xml", stor_callback)
-        except:
-            ftp.quit()
-            show_error_dialog("Error downloading data from server. Please \
-                                check permissions.")
-            return False
-        
-    #6. create database and sync
-    try:
-        remote_db = DataBase("/tmp/.task_db.xml", prototype)
-        local_db.sync("ftp", remote_db)
-        remote_db.commit()
-        local_db.commit()
-    except:
-        def try_again():
-            t = SyncThread(local_db, prototype, ftp_server, ftp_username, \
-                            ftp_password, ftp_dir, cb_finish)
-            t.start()
-        show_retry_error_dialog("Can't sync databases.", try_again)
-        ftp.quit()
-        return False
-    
-    #7. upload db
-    try:
-        f = open("/tmp/.task_db.xml", "r")
-        ftp.storlines("STOR .task_db.xml", f)
-        f.close()
-    except:
-        show_error_dialog("Error writing data to server. Please check \
-                            permissions.")
-        ftp.quit()
-        return False
-    
-    #8. release lock
-    try:
-        ftp.delete(".task-lock")
-    except:
-        show_error_dialog("Error writing data to server. Please check \
-                            permissions.")
-        ftp.quit()
-        return False
-
-    ftp.quit()
-    gobject.idle_add(cb_finish)
-    return True
-
-
 class SyncThread(threading.Thread):
     
     def __init__(self, local_db, prototype, ftp_server, ftp_username, \
-                    ftp_password, ftp_dir, cb_finish, force=False):
+                    ftp_password, ftp_dir, cb_finish, force=False, \
+                    history=None, max_age=0, remotes=(), list_name="", \
+                    cb_done=None):
         super(SyncThread, self).__init__()
         self._local_db = local_db
         self._prototype = prototype
@@ -244,8 +132,75 @@ class SyncThread(threading.Thread):
         self._ftp_dir = ftp_dir
         self._cb_finish = cb_finish
         self._force = force
+        self._history = history
+        self._max_age = max_age
+        self._remotes = remotes
+        self._list_name = list_name
+        #called on the main loop once the sync and its retries are over
+        self._cb_done = cb_done
         
     def run(self):
-        res = sync_tasks(self._local_db, self._prototype, self._ftp_server, \
-                            self._ftp_username, self._ftp_password, \
-                            self._ftp_dir, self._cb_finish, self._force)
+        try:
+            self._sync()
+        finally:
+            if self._cb_done != None:
+                gobject.idle_add(self._cb_done)
+                
+    def _sync(self):
+        try:
+            if isinstance(self._local_db, task_daemon.RemoteDataBase):
+                #the daemon syncs once for all of its clients
+                self._local_db.request_sync(self._ftp_server, \
+                                            self._ftp_username, \
+                                            self._ftp_password, self._ftp_dir, \
+                                            self._force, self._max_age, \
+                                            self._remotes)
+            else:
+                sync_core.sync_all(self._local_db, self._prototype, \
+                                    self._ftp_server, self._ftp_username, \
+                                    self._ftp_password, self._ftp_dir, \
+                                    self._remotes, self._force, self._history, \
+                                    list_name=self._list_name)
+        except sync_core.ErrorConnect:
+            show_error_dialog("Can't connect to host <i>%s</i>.\nPlease check \
+                                your connection settings." % self._ftp_server)
+        except sync_core.ErrorDirectory:
+            show_error_dialog("It seems the directory <i>%s</i>\ndoes not \
+                                exists on the server." % self._ftp_dir)
+        except sync_core.ErrorLocked:
+            show_force_error_dialog("Can't acquire an exclusive lock on the \
+                                    remote data.\nEither another application \
+                                    is using the data\nor a synchronization \
+                                    attempt failed less than %d minutes \
+                                    ago.\n\nYou can retry or force the sync. \
+                                    Forcing it may result in data loss!\nClick \
+                                    Ok to abort." % (transports.LOCK_LEASE / 60), \
+                                    self._retry, self._force_sync)
+        except sync_core.ErrorDownload:
+            show_error_dialog("Error downloading data from server. Please \
+                                check permissions.")
+        except sync_core.ErrorMerge:
+            show_retry_error_dialog("Can't sync databases.", self._retry)
+        except sync_core.ErrorWrite:
+            show_error_dialog("Error writing data to server. Please check \
+                                permissions.")
+        except sync_core.ErrorConflict:
+            show_retry_error_dialog("The remote data was changed during the \
+                                    sync.", self._retry)
+        except task_daemon.Error:
+            show_error_dialog("Lost the connection to the task daemon.")
+        else:
+            gobject.idle_add(self._cb_finish)
+            
+    def _retry(self, force=False):
+        t = SyncThread(self._local_db, self._prototype, self._ftp_server, \
+                        self._ftp_username, self._ftp_password, \
+                        self._ftp_dir, self._cb_finish, force, self._history, \
+                        remotes=self._remotes, list_name=self._list_name, \
+                        cb_done=self._cb_done)
+        #the retry thread calls cb_done instead of this one
+        self._cb_done = None
+        t.start()
+        
+    def _force_sync(self):
+        self._retry(True)
@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       sync_core.py
+#       
+#       Copyright 2010 Sven Festersen <sven@sven-festersen.de>
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""
+The GTK-free part of the synchronization. The remote data is accessed
+through a transport (see transports.py). Errors are raised as exceptions,
+sync.py shows them in dialogs.
+
+The last downloaded remote file is cached next to the local database
+together with its etag, so an unchanged remote file is not downloaded
+again, and the remote file is only uploaded if the sync changed it. A
+merged copy whose upload failed is marked as pending and uploaded by the
+next sync unless the remote file changed in the meantime.
+
+Several remotes can be synced at once (see sync_many). Every remote is a
+sync source of its own with its own cached copy, the transfers run
+concurrently and only the merges into the local database are serialized.
+Every task list has its own remote files (see Transport.set_list), so a
+list is synced without waiting for the others.
+
+Long values are kept in blobs (see simple_db.blobs) that are transferred
+separately. A blob never changes, so it is only downloaded if the local
+store lacks it and only uploaded if the sync added a reference to it.
+"""
+import ftplib
+import hashlib
+import httplib
+import os
+import Queue
+import socket
+import sys
+import threading
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from simple_db.database import DataBase, get_file_stamp
+from sync_errors import *
+from sync_trace import SyncTrace
+import transports
+
+
+MAX_SYNC_WORKERS = 4
+
+#parsed remote databases by cache file, with the stamp of the file
+_snapshots = {}
+
+
+def sync_tasks(local_db, prototype, ftp_server, ftp_username, ftp_password, \
+                ftp_dir, force=False, history=None, source_id="ftp", \
+                list_name=""):
+    """
+    This function syncs the local db with the remote data of the task list
+    list_name on the given server (see transports.get_transport). Every
+    phase is traced and the trace is added to history if given. Raises one
+    of the errors in sync_errors if the sync fails.
+    """
+    transport = transports.get_transport(ftp_server, ftp_username, \
+                                            ftp_password, ftp_dir)
+    transport.set_list(list_name)
+    sync_with_transport(local_db, prototype, transport, force, history, \
+                        source_id)
+    
+def sync_all(local_db, prototype, ftp_server, ftp_username, ftp_password, \
+                ftp_dir, remote_urls=(), force=False, history=None, \
+                max_workers=MAX_SYNC_WORKERS, list_name=""):
+    """
+    Syncs the local db with the server given by the ftp settings (sync
+    source "ftp") and the additional remotes in remote_urls at the same
+    time, the remote files of the task list list_name are used. Raises the
+    error of the first remote that failed, in the order given, after all
+    remotes are done.
+    """
+    remotes = [("ftp", transports.get_transport(ftp_server, ftp_username, \
+                                                ftp_password, ftp_dir))]
+    for url in remote_urls:
+        remotes.append((get_source_id(url), transports.get_transport(url)))
+    for source_id, transport in remotes:
+        transport.set_list(list_name)
+    errors = sync_many(local_db, prototype, remotes, force, history, \
+                        max_workers)
+    for source_id, transport in remotes:
+        if errors.get(source_id) != None:
+            raise errors[source_id]
+            
+def sync_many(local_db, prototype, remotes, force=False, history=None, \
+                max_workers=MAX_SYNC_WORKERS):
+    """
+    Syncs the local db with every (source_id, transport) in remotes. At
+    most max_workers remotes are synced concurrently, their merges into the
+    local db are serialized. Returns a dict that maps every source id to the
+    error its sync raised or None.
+    """
+    for source_id, transport in remotes:
+        if not local_db.has_sync_source(source_id):
+            local_db.add_sync_source(source_id)
+    queue = Queue.Queue()
+    for remote in remotes:
+        queue.put(remote)
+    merge_lock = threading.Lock()
+    errors = {}
+    
+    def worker():
+        while True:
+            try:
+                source_id, transport = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                sync_with_transport(local_db, prototype, transport, force, \
+                                    history, source_id, merge_lock)
+                errors[source_id] = None
+            except Exception, e:
+                errors[source_id] = get_sync_error(e)
+                
+    threads = [threading.Thread(target=worker) \
+                for i in range(min(max_workers, len(remotes)))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return errors
+    
+def sync_with_transport(local_db, prototype, transport, force=False, \
+                        history=None, source_id="ftp", merge_lock=None):
+    trace = SyncTrace(transport.name)
+    success = False
+    try:
+        _sync_tasks(local_db, prototype, transport, force, trace, source_id, \
+                    merge_lock)
+        success = True
+    finally:
+        trace.finish(success)
+        if history != None:
+            history.add(trace)
+            
+def get_sync_error(e):
+    """
+    Returns the error of sync_errors for an exception raised by a sync,
+    e.g. a socket.error of a dropped connection becomes an ErrorConnect.
+    """
+    if isinstance(e, Error):
+        return e
+    if isinstance(e, (EnvironmentError, EOFError, httplib.HTTPException) + \
+                    ftplib.all_errors):
+        return ErrorConnect(str(e))
+    return ErrorMerge(str(e))
+    
+def get_cache_filename(local_db, source_id):
+    return "%s.%s.remote" % (local_db.filename, source_id)
+    
+def get_source_id(url):
+    """
+    Returns the sync source id of the additional remote at url.
+    """
+    return "remote-" + hashlib.md5(url).hexdigest()[:12]
+    
+def _read_file(filename):
+    if not os.path.exists(filename):
+        return None
+    f = open(filename, "rb")
+    try:
+        return f.read()
+    finally:
+        f.close()
+        
+def _write_file(filename, data):
+    f = open(filename, "wb")
+    f.write(data)
+    f.close()
+    
+def _remove_file(filename):
+    if os.path.exists(filename):
+        os.remove(filename)
+        
+def _read_pending(filename):
+    """
+    Returns the set of blob hashes in the pending file of a cached copy or
+    None if no upload is pending.
+    """
+    data = _read_file(filename)
+    if data == None:
+        return None
+    return set(data.split())
+    
+def _take_snapshot(cache_file, prototype):
+    """
+    Returns the database in cache_file. The database parsed by the last
+    successful sync is reused if the file did not change since, so a sync
+    without remote changes does not parse the file again.
+    """
+    stamp = get_file_stamp(cache_file)
+    #a failed sync leaves its snapshot modified, so it is only put back by
+    #_keep_snapshot
+    snapshot = _snapshots.pop(cache_file, None)
+    if snapshot != None and stamp != None and snapshot[0] == stamp:
+        return snapshot[1]
+    return DataBase(cache_file, prototype)
+    
+def _keep_snapshot(cache_file, remote_db):
+    _snapshots[cache_file] = (get_file_stamp(cache_file), remote_db)
+            
+def _download_blobs(local_db, transport, hashes, trace):
+    for hash in hashes:
+        if not local_db.blobs.has(hash):
+            #the lease must not run out while many blobs are downloaded
+            transport.renew()
+            data = transport.get_blob(hash, trace.add_bytes_callback)
+            try:
+                local_db.blobs.put_data(hash, data)
+            except:
+                raise ErrorDownload()
+    transport.renew()
+    
+def get_lease_owner(local_db):
+    """
+    Returns the client id of the remote lock. Every process that opens the
+    database file has the same database id, so the host and the process
+    are part of it.
+    """
+    return "%s-%s-%d" % (local_db.id, socket.gethostname(), os.getpid())
+    
+def _lock_cache(cache_file):
+    """
+    Takes an exclusive advisory lock that keeps other processes from
+    syncing the same source of the same database, they would write the
+    same cache files. Returns the lock file or None if locking is not
+    possible.
+    """
+    if fcntl == None:
+        return None
+    try:
+        lock_file = open(cache_file + ".sync-lock", "a")
+    except IOError:
+        return None
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    return lock_file
+    
+def _unlock_cache(lock_file):
+    if lock_file != None:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+        
+def _sync_tasks(local_db, prototype, transport, force, trace, source_id, \
+                merge_lock):
+    #another process syncing the same source goes first
+    cache_lock = _lock_cache(get_cache_filename(local_db, source_id))
+    try:
+        #1. connect
+        trace.start_phase("connect")
+        transport.connect()
+        try:
+            #2. acquire lock, only the lock file is looked at
+            trace.start_phase("lock")
+            transport.lock(get_lease_owner(local_db), force)
+            try:
+                _sync_locked(local_db, prototype, transport, trace, \
+                                source_id, merge_lock)
+            except:
+                #release the lease right away instead of letting it expire,
+                #the error of the sync is the one to report
+                exc_info = sys.exc_info()
+                try:
+                    transport.unlock()
+                except Exception:
+                    pass
+                raise exc_info[0], exc_info[1], exc_info[2]
+                
+            #6. release lock
+            trace.start_phase("unlock")
+            transport.unlock()
+            trace.end_phase()
+        finally:
+            transport.close()
+    finally:
+        _unlock_cache(cache_lock)
+        
+def _sync_locked(local_db, prototype, transport, trace, source_id, \
+                    merge_lock):
+    #3. download database file unless the cached copy is current
+    trace.start_phase("download")
+    cache_file = get_cache_filename(local_db, source_id)
+    etag_file = cache_file + ".etag"
+    #exists while the merged cache file differs from the remote file
+    pending_file = cache_file + ".pending"
+    etag = None
+    if os.path.exists(cache_file):
+        etag = _read_file(etag_file)
+    status, data, etag = transport.get(etag, trace.add_bytes_callback)
+    if status == transports.GET_MODIFIED:
+        _write_file(cache_file, data)
+        _remove_file(pending_file)
+    elif status == transports.GET_MISSING:
+        _remove_file(cache_file)
+        _remove_file(pending_file)
+    transport.renew()
+    
+    #4. create database and sync
+    trace.start_phase("merge")
+    try:
+        remote_db = _take_snapshot(cache_file, prototype)
+        #the cached copy shares the blobs of the local database
+        remote_db.blobs = local_db.blobs
+        revision = remote_db.revision
+        remote_blobs = remote_db.get_blob_hashes()
+    except:
+        raise ErrorMerge()
+    _download_blobs(local_db, transport, remote_blobs, trace)
+    try:
+        #concurrent syncs with other remotes take turns here
+        if merge_lock != None:
+            merge_lock.acquire()
+        try:
+            local_db.sync(source_id, remote_db)
+            changed = remote_db.revision != revision
+            if changed:
+                remote_db.commit()
+            local_db.commit()
+        finally:
+            if merge_lock != None:
+                merge_lock.release()
+        if changed:
+            #the blobs the remote file lacks are uploaded together with it
+            pending = _read_pending(pending_file) or set()
+            pending.update(remote_db.get_blob_hashes() - remote_blobs)
+            _write_file(pending_file, "\n".join(sorted(pending)))
+        _keep_snapshot(cache_file, remote_db)
+    except:
+        raise ErrorMerge()
+    transport.renew()
+    
+    #5. upload db if the sync changed it or an earlier upload failed, new
+    #blobs go first so the remote file never refers to a missing blob
+    trace.start_phase("upload")
+    pending = _read_pending(pending_file)
+    if pending != None:
+        for hash in sorted(pending):
+            transport.renew()
+            transport.put_blob(hash, local_db.blobs.get_data(hash), \
+                                trace.add_bytes_callback)
+        transport.renew()
+        etag = transport.put(_read_file(cache_file), etag, \
+                                trace.add_bytes_callback)
+        _remove_file(pending_file)
+    if etag != None:
+        _write_file(etag_file, etag)
+    else:
+        _remove_file(etag_file)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       sync_errors.py
+#       
+#       Copyright 2010 Sven Festersen <sven@sven-festersen.de>
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""
+The errors of the synchronization, shared by sync_core and the transports.
+"""
+
+
+class Error(Exception):
+    pass
+    
+    
+class ErrorConnect(Error):
+    pass
+    
+    
+class ErrorDirectory(Error):
+    pass
+    
+    
+class ErrorLocked(Error):
+    pass
+    
+    
+class ErrorWrite(Error):
+    pass
+    
+    
+class ErrorDownload(Error):
+    pass
+    
+    
+class ErrorMerge(Error):
+    pass
+    
+    
+class ErrorConflict(Error):
+    """
+    The remote data was changed by someone not holding the lock.
+    """
+    pass
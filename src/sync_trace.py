@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       sync_trace.py
+#       
+#       Copyright 2010 Sven Festersen <sven@sven-festersen.de>
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+import json
+import os
+import threading
+import time
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from simple_db.database import get_file_stamp
+
+
+class SyncTrace(object):
+    """
+    Records the duration and the transferred bytes of every phase of one
+    synchronization.
+    """
+    
+    def __init__(self, server):
+        super(SyncTrace, self).__init__()
+        self.server = server
+        self.started = time.time()
+        self.finished = None
+        self.success = False
+        self.failed_phase = None
+        self.phases = []
+        self._phase = None
+        
+    def start_phase(self, name):
+        if self._phase != None:
+            self.end_phase()
+        self._phase = {"name": name, "start": time.time(), "bytes": 0}
+        
+    def add_bytes(self, n):
+        if self._phase != None:
+            self._phase["bytes"] += n
+        
+    def add_bytes_callback(self, data):
+        """
+        Callback for ftplib transfers that counts the transferred bytes.
+        """
+        self.add_bytes(len(data))
+        
+    def end_phase(self):
+        phase = self._phase
+        self._phase = None
+        self.phases.append({"name": phase["name"], "bytes": phase["bytes"],
+                            "duration": time.time() - phase["start"]})
+        
+    def finish(self, success):
+        """
+        Ends the trace. If it failed the currently running phase is
+        remembered as the failed one.
+        """
+        if self._phase != None:
+            if not success:
+                self.failed_phase = self._phase["name"]
+            self.end_phase()
+        self.success = success
+        self.finished = time.time()
+        
+    def get_duration(self):
+        if self.finished == None:
+            return time.time() - self.started
+        return self.finished - self.started
+        
+    def get_bytes(self):
+        return sum([phase["bytes"] for phase in self.phases])
+        
+    def as_dict(self):
+        return {"server": self.server, "started": self.started,
+                "duration": self.get_duration(), "bytes": self.get_bytes(),
+                "success": self.success, "failed_phase": self.failed_phase,
+                "phases": self.phases}
+        
+        
+class SyncHistory(object):
+    """
+    A rolling history of sync traces that is stored as JSON in filename.
+    The file is shared by all processes (screenlet, daemon, todo_cli.py),
+    new traces are merged with the entries on disk under a file lock.
+    """
+    
+    def __init__(self, filename, max_entries=100):
+        super(SyncHistory, self).__init__()
+        self.filename = filename
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = []
+        self._stamp = None
+        self._load()
+        
+    def add(self, trace):
+        self._lock.acquire()
+        try:
+            lock_file = self._lock_file()
+            try:
+                #keep the entries other processes added meanwhile
+                self._load()
+                self._entries.append(trace.as_dict())
+                self._entries = self._entries[-self.max_entries:]
+                self._write(self.filename)
+                self._stamp = get_file_stamp(self.filename)
+            finally:
+                if lock_file != None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    lock_file.close()
+        finally:
+            self._lock.release()
+        
+    def last(self):
+        """
+        Returns the most recent entry as a dict or None.
+        """
+        self._lock.acquire()
+        try:
+            self._load()
+            entry = None
+            if len(self._entries) > 0:
+                entry = self._entries[-1]
+        finally:
+            self._lock.release()
+        return entry
+        
+    def entries(self):
+        self._lock.acquire()
+        try:
+            self._load()
+            entries = list(self._entries)
+        finally:
+            self._lock.release()
+        return entries
+        
+    def export(self, filename):
+        self._lock.acquire()
+        try:
+            self._load()
+            self._write(filename)
+        finally:
+            self._lock.release()
+            
+    def _load(self):
+        """
+        Reads the entries again if another process changed the file.
+        """
+        stamp = get_file_stamp(self.filename)
+        if stamp == None or stamp == self._stamp:
+            return
+        try:
+            f = open(self.filename, "r")
+            try:
+                self._entries = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            pass
+        self._stamp = stamp
+        
+    def _lock_file(self):
+        """
+        Returns the locked lock file of the history, or None if locking is
+        not possible.
+        """
+        if fcntl == None:
+            return None
+        try:
+            lock_file = open(self.filename + ".lock", "a")
+        except IOError:
+            return None
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+            
+    def _write(self, filename):
+        #readers never see a partly written file
+        tmp_filename = filename + ".tmp"
+        f = open(tmp_filename, "w")
+        json.dump(self._entries, f, indent=1)
+        f.close()
+        os.rename(tmp_filename, filename)
+        
+        
+def format_entry(entry):
+    """
+    Makes a short summary like 'Last sync took 1.2 s, 34.5 KB' of a history
+    entry.
+    """
+    if entry == None:
+        return "Not synced yet"
+    txt = "Last sync took %.1f s, %.1f KB" % (entry["duration"], \
+                                                entry["bytes"] / 1024.0)
+    if not entry["success"]:
+        txt += " (failed: %s)" % entry["failed_phase"]
+    return txt
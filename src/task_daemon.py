@@ -0,0 +1,527 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       task_daemon.py
+#       
+#       Copyright 2010 Sven Festersen <sven@sven-festersen.de>
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""
+A daemon that owns the task database and serves it to screenlet instances
+and other clients over a Unix domain socket, so that the database is parsed,
+held and synced with the ftp server only once however many clients attach.
+
+Every message is a JSON object preceded by its length as a 4 byte big
+endian integer. Requests carry an "op", replies have "ok" and either the
+results or an "error". Objects are sent as
+{"id": ID, "tc": CREATED, "tm": MODIFIED, "f": {FIELD: [VALUE, MODIFIED]}}.
+
+Requests:
+  snapshot              all objects
+  commit                merge the objects in "put", delete the ids in "delete"
+  archive               archive the objects with the given "ids"
+  sync                  sync with the ftp server unless a sync started less
+                        than "max_age" seconds before the request
+  subscribe             turns the connection into a change feed, every
+                        change is sent as {"put": [...], "delete": [...]}
+
+Every task list is served by a daemon of its own, see get_socket_path.
+
+Usage: task_daemon.py [--list NAME] [--file FILE] [--socket SOCKET]
+"""
+import json
+import optparse
+import os
+import socket
+import SocketServer
+import struct
+import sys
+import threading
+import time
+
+from simple_db.blobs import BlobRef, BlobStore
+from simple_db.database import DataBase
+from simple_db.watcher import FileWatcher
+import sync_core
+import sync_trace
+from tasks import Task, DEFAULT_LIST, get_list_filename, is_list_name
+
+DEFAULT_SOCKET = os.path.expanduser("~/.task_daemon.sock")
+LIST_SOCKET = os.path.expanduser("~/.task_daemon.%s.sock")
+
+
+class Error(Exception):
+    pass
+    
+    
+class ErrorProtocol(Error):
+    pass
+    
+    
+class ErrorRunning(Error):
+    pass
+    
+    
+class ErrorRequest(Error):
+    pass
+    
+    
+def send_message(sock, msg):
+    data = json.dumps(msg)
+    sock.sendall(struct.pack("!I", len(data)) + data)
+    
+def _recv_exactly(sock, n):
+    chunks = []
+    while n > 0:
+        chunk = sock.recv(min(n, 65536))
+        if chunk == "":
+            return None
+        chunks.append(chunk)
+        n -= len(chunk)
+    return "".join(chunks)
+    
+def recv_message(sock):
+    """
+    Returns the next message or None if the connection was closed.
+    """
+    header = _recv_exactly(sock, 4)
+    if header == None:
+        return None
+    data = _recv_exactly(sock, struct.unpack("!I", header)[0])
+    if data == None:
+        raise ErrorProtocol
+    return json.loads(data)
+    
+def _to_str(value):
+    if type(value) == unicode:
+        return value.encode("utf-8")
+    return value
+    
+def object_to_wire(obj):
+    fields = {}
+    for id, field in obj:
+        value = field.value
+        if isinstance(value, BlobRef):
+            #clients read the blob store of the daemon themselves
+            value = {"blob": value.hash}
+        fields[id] = [value, field.modified]
+    return {"id": obj.id, "tc": obj.created, "tm": obj.modified, "f": fields}
+    
+def object_from_wire(prototype, data):
+    obj = prototype(_to_str(data["id"]), data["tc"], data["tm"])
+    for fid, (value, modified) in data["f"].iteritems():
+        if isinstance(value, dict):
+            value = BlobRef(value["blob"])
+        obj.field(_to_str(fid)).update(_to_str(value), modified)
+    obj.creation_finished = True
+    return obj
+    
+def connect(socket_path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_path)
+    return sock
+    
+def get_socket_path(list_name):
+    """
+    Returns the socket of the daemon that serves the task list list_name.
+    """
+    if list_name == DEFAULT_LIST:
+        return DEFAULT_SOCKET
+    return LIST_SOCKET % list_name
+    
+def daemon_running(socket_path=DEFAULT_SOCKET):
+    try:
+        connect(socket_path).close()
+    except socket.error:
+        return False
+    return True
+    
+    
+class _Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+    
+    
+class _Handler(SocketServer.BaseRequestHandler):
+    
+    def handle(self):
+        daemon = self.server.task_daemon
+        while True:
+            try:
+                request = recv_message(self.request)
+            except (ErrorProtocol, ValueError, socket.error):
+                return
+            if request == None:
+                return
+            if request.get("op") == "subscribe":
+                daemon.subscribe(self.request)
+                #only the daemon writes to the connection from now on
+                while self.request.recv(4096) != "":
+                    pass
+                daemon.unsubscribe(self.request)
+                return
+            try:
+                send_message(self.request, daemon.handle(request))
+            except socket.error:
+                return
+            
+            
+class TaskDaemon(object):
+    """
+    Serves the task database in filename on a Unix domain socket. It is
+    synced with the remote files of the task list list_name.
+    """
+    
+    def __init__(self, filename=None, socket_path=DEFAULT_SOCKET, \
+                    list_name=DEFAULT_LIST):
+        super(TaskDaemon, self).__init__()
+        if filename == None:
+            filename = get_list_filename(list_name)
+        self.list_name = list_name
+        self.db = DataBase(filename, Task)
+        if not self.db.has_sync_source("ftp"):
+            self.db.add_sync_source("ftp")
+        self.socket_path = socket_path
+        self.history = sync_trace.SyncHistory( \
+                                os.path.expanduser("~/.task_sync_history"))
+        self._subscribers = []
+        self._subscribers_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._last_sync_start = 0
+        self._watcher = FileWatcher(filename, self._cb_file_changed)
+        self.db.subscribe(self._cb_changes)
+        self._server = None
+        
+    def serve_forever(self):
+        if daemon_running(self.socket_path):
+            raise ErrorRunning
+        if os.path.exists(self.socket_path):
+            #left behind by a daemon that died
+            os.remove(self.socket_path)
+        self._server = _Server(self.socket_path, _Handler)
+        self._server.task_daemon = self
+        os.chmod(self.socket_path, 0600)
+        self._watcher.start()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._watcher.stop()
+            os.remove(self.socket_path)
+            
+    def shutdown(self):
+        self._server.shutdown()
+        
+    def handle(self, request):
+        handler = getattr(self, "_op_" + str(request.get("op")), None)
+        if handler == None:
+            return {"ok": False, "error": "unknown op"}
+        try:
+            reply = handler(request)
+        except sync_core.Error, e:
+            return {"ok": False, "error": e.__class__.__name__}
+        except Exception, e:
+            return {"ok": False, "error": repr(e)}
+        reply["ok"] = True
+        return reply
+        
+    def subscribe(self, sock):
+        self._subscribers_lock.acquire()
+        try:
+            #the reply is sent first, changes follow
+            send_message(sock, {"ok": True})
+            self._subscribers.append(sock)
+        except socket.error:
+            pass
+        finally:
+            self._subscribers_lock.release()
+        
+    def unsubscribe(self, sock):
+        self._subscribers_lock.acquire()
+        if sock in self._subscribers:
+            self._subscribers.remove(sock)
+        self._subscribers_lock.release()
+        
+    def _cb_changes(self, changes):
+        put = [object_to_wire(obj) for obj in changes.added.itervalues()]
+        for id in changes.changed:
+            if id in self.db:
+                put.append(object_to_wire(self.db[id]))
+        #replaced objects are sent as put only
+        delete = [id for id in changes.removed if not id in changes.added]
+        msg = {"put": put, "delete": delete}
+        self._subscribers_lock.acquire()
+        try:
+            for sock in self._subscribers[:]:
+                try:
+                    send_message(sock, msg)
+                except socket.error:
+                    self._subscribers.remove(sock)
+        finally:
+            self._subscribers_lock.release()
+            
+    def _op_snapshot(self, request):
+        return {"objects": [object_to_wire(obj) for obj in self.db.query()], \
+                "blobs": self.db.blobs.directory}
+        
+    def _op_commit(self, request):
+        objs = [object_from_wire(Task, data) for data in request["put"]]
+        deleted_ids = [_to_str(id) for id in request["delete"]]
+        self.db.apply(objs, deleted_ids)
+        self.db.commit()
+        return {}
+        
+    def _op_archive(self, request):
+        ids = [_to_str(id) for id in request["ids"] if _to_str(id) in self.db]
+        self.db.archive(ids)
+        self.db.commit()
+        return {}
+        
+    def _op_sync(self, request):
+        requested = time.time()
+        self._sync_lock.acquire()
+        try:
+            #requests that arrive during a sync share the next one, recent
+            #enough syncs are shared by all clients
+            if self._last_sync_start >= requested - request.get("max_age", 0):
+                return {"synced": False}
+            self._last_sync_start = time.time()
+            sync_core.sync_all(self.db, Task, request["server"], \
+                                request["user"], request["password"], \
+                                request["dir"], request.get("remotes", []), \
+                                request.get("force", False), self.history, \
+                                list_name=self.list_name)
+            return {"synced": True}
+        finally:
+            self._sync_lock.release()
+            
+    def _cb_file_changed(self):
+        #e.g. todo_cli.py wrote the file, the changes are published by
+        #_cb_changes
+        self.db.reload()
+        
+        
+class RemoteDataBase(DataBase):
+    """
+    A database that mirrors the database of a running task daemon. Local
+    changes are sent to the daemon on commit, changes made by other clients
+    are collected by the watcher (see get_watcher) and merged by reload().
+    """
+    
+    def __init__(self, socket_path, prototype):
+        DataBase.__init__(self, socket_path, prototype, load=False)
+        self.socket_path = socket_path
+        self._socket = connect(socket_path)
+        self._request_lock = threading.Lock()
+        self._events = []
+        self._events_lock = threading.Lock()
+        #subscribe before taking the snapshot so that no change is missed
+        self._feed = _EventWatcher(self)
+        self._feed.start()
+        snapshot = self._request({"op": "snapshot"})
+        self.blobs = BlobStore(_to_str(snapshot["blobs"]))
+        objs = [object_from_wire(prototype, data) for data in \
+                snapshot["objects"]]
+        self.add_many(objs)
+        self._pushed = dict((obj.id, obj.modified) for obj in objs)
+        
+    def _request(self, request):
+        self._request_lock.acquire()
+        try:
+            send_message(self._socket, request)
+            reply = recv_message(self._socket)
+        finally:
+            self._request_lock.release()
+        if reply == None:
+            raise ErrorProtocol
+        if not reply["ok"]:
+            error = getattr(sync_core, str(reply["error"]), None)
+            if error != None and issubclass(error, sync_core.Error):
+                raise error()
+            raise ErrorRequest(reply["error"])
+        return reply
+        
+    def commit(self):
+        self._commit_lock.acquire()
+        try:
+            self._lock.acquire_read()
+            try:
+                put = [object_to_wire(obj) for obj in self._data.itervalues() \
+                        if self._pushed.get(obj.id) != obj.modified]
+                delete = [id for id in self._pushed if not id in self._data]
+                pushed = dict((id, obj.modified) for id, obj in \
+                                self._data.iteritems())
+            finally:
+                self._lock.release_read()
+            if len(put) + len(delete) > 0:
+                self._request({"op": "commit", "put": put, "delete": delete})
+            self._pushed = pushed
+        finally:
+            self._commit_lock.release()
+            
+    def reload(self):
+        """
+        Merges the changes received from the daemon since the last call.
+        Returns the lists (added, removed, changed) of affected ids.
+        """
+        self._events_lock.acquire()
+        events = self._events
+        self._events = []
+        self._events_lock.release()
+        added = []
+        removed = []
+        changed = []
+        for event in events:
+            objs = [object_from_wire(self.prototype, data) for data in \
+                    event["put"]]
+            a, r, c = self.apply(objs, [_to_str(id) for id in event["delete"]])
+            added.extend(a)
+            removed.extend(r)
+            changed.extend(c)
+            for id in a + c:
+                self._pushed[id] = self[id].modified
+            for id in r:
+                self._pushed.pop(id, None)
+        return (added, removed, changed)
+        
+    def archive(self, ids):
+        self._request({"op": "archive", "ids": list(ids)})
+        self._lock.acquire_write()
+        try:
+            for id in ids:
+                if id in self._data:
+                    self._remove(id)
+                self._archived.add(id)
+                self._pushed.pop(id, None)
+        finally:
+            self._release_write()
+            
+    def request_sync(self, ftp_server, ftp_username, ftp_password, ftp_dir, \
+                        force=False, max_age=0, remotes=()):
+        """
+        Asks the daemon to sync with the ftp server and the additional
+        remotes (see sync_core.sync_all). The daemon skips the sync if one
+        started less than max_age seconds ago. Raises the errors of
+        sync_core.
+        """
+        self._request({"op": "sync", "server": ftp_server, \
+                        "user": ftp_username, "password": ftp_password, \
+                        "dir": ftp_dir, "force": force, "max_age": max_age, \
+                        "remotes": list(remotes)})
+        
+    def get_watcher(self, callback):
+        self._feed.callback = callback
+        return self._feed
+        
+    def close(self):
+        """
+        Closes the connections to the daemon. Uncommitted changes are lost.
+        """
+        self._feed.stop()
+        self._socket.close()
+        
+        
+class _EventWatcher(object):
+    """
+    Receives the change feed of the daemon for a RemoteDataBase and calls
+    callback from a background thread whenever changes arrived. The feed is
+    started by the database itself, so start() only has an effect once.
+    """
+    
+    def __init__(self, db, callback=None):
+        super(_EventWatcher, self).__init__()
+        self.db = db
+        self.callback = callback
+        self._socket = None
+        
+    def start(self):
+        if self._socket != None:
+            return
+        self._socket = connect(self.db.socket_path)
+        send_message(self._socket, {"op": "subscribe"})
+        if recv_message(self._socket) == None:
+            raise ErrorProtocol
+        t = threading.Thread(target=self._run)
+        t.setDaemon(True)
+        t.start()
+        
+    def stop(self):
+        self._socket.close()
+        
+    def _run(self):
+        while True:
+            try:
+                event = recv_message(self._socket)
+            except (ErrorProtocol, socket.error):
+                return
+            if event == None:
+                return
+            self.db._events_lock.acquire()
+            self.db._events.append(event)
+            self.db._events_lock.release()
+            if self.callback != None:
+                self.callback()
+            
+            
+def open_database(filename, prototype, socket_path=DEFAULT_SOCKET):
+    """
+    Returns a RemoteDataBase if a daemon is listening on socket_path,
+    otherwise the database in filename is opened directly.
+    """
+    if daemon_running(socket_path):
+        return RemoteDataBase(socket_path, prototype)
+    return DataBase(filename, prototype)
+    
+def close_database(db):
+    """
+    Releases a database returned by open_database.
+    """
+    if isinstance(db, RemoteDataBase):
+        db.close()
+        
+def get_watcher(db, callback):
+    """
+    Returns a watcher that calls callback when other processes changed db.
+    """
+    if isinstance(db, RemoteDataBase):
+        return db.get_watcher(callback)
+    return FileWatcher(db.filename, callback)
+    
+    
+def main(argv):
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-l", "--list", default=DEFAULT_LIST, \
+                        help="task list to serve [default: the default list]")
+    parser.add_option("-f", "--file", \
+                        help="task database file [default: the file of the " \
+                        "list]")
+    parser.add_option("-s", "--socket", \
+                        help="socket to listen on [default: the socket of " \
+                        "the list]")
+    options, args = parser.parse_args(argv)
+    if not is_list_name(options.list):
+        parser.error("invalid list name: %s" % options.list)
+    if options.socket == None:
+        options.socket = get_socket_path(options.list)
+    try:
+        TaskDaemon(options.file, options.socket, \
+                    options.list).serve_forever()
+    except ErrorRunning:
+        sys.exit("A daemon is already listening on %s." % options.socket)
+    except KeyboardInterrupt:
+        pass
+        
+        
+if __name__ == '__main__':
+    main(sys.argv[1:])
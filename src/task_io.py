@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       task_io.py
+#       
+#       Copyright 2010 Sven Festersen <sven@sven-festersen.de>
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""
+Streaming import and export of tasks as JSON Lines and as iCalendar VTODO
+components. The readers are generators and the writers consume iterables,
+one task at a time, so their memory use does not depend on the number of
+tasks. Nothing in here may import GTK.
+"""
+import calendar
+import datetime
+import json
+import re
+import time
+import uuid
+
+from simple_db import dataobject
+from tasks import Task
+
+FORMAT_JSONL = "jsonl"
+FORMAT_VTODO = "ics"
+FORMATS = [FORMAT_JSONL, FORMAT_VTODO]
+
+PRODID = "-//LocalTODOScreenlet//Tasks//EN"
+#maximum length of an iCalendar line in octets, longer lines are folded
+ICAL_LINE_LENGTH = 75
+
+
+class Error(Exception):
+    pass
+    
+    
+class ErrorFormat(Error):
+    """
+    Raised if the data can't be read in the given format.
+    """
+    pass
+    
+    
+def get_format(filename):
+    """
+    Guesses the format of filename from its extension.
+    """
+    if filename != None and filename.lower().endswith((".ics", ".ical")):
+        return FORMAT_VTODO
+    return FORMAT_JSONL
+    
+def make_task(id=None, created=None, modified=None, title="", comment="", \
+                due_date=-1, done=False):
+    """
+    Creates a task from imported data. Every field gets the modification
+    time of the task, a task without id gets a new unique one.
+    """
+    now = time.time()
+    if id == None:
+        id = uuid.uuid4().hex
+    if created == None:
+        created = now
+    if modified == None:
+        modified = now
+    task = Task(_text(id), created, modified)
+    values = {"title": _text(title), "comment": _text(comment), \
+                "due_date": int(due_date), "done": bool(done)}
+    for fid, value in values.iteritems():
+        field = task.field(fid)
+        super(dataobject.DataField, field).__setattr__("value", value)
+        super(dataobject.DataField, field).__setattr__("modified", modified)
+    task.creation_finished = True
+    return task
+    
+def read_tasks(f, format=FORMAT_JSONL):
+    """
+    Yields the tasks read from the file object f.
+    """
+    if format == FORMAT_VTODO:
+        return read_vtodo(f)
+    return read_jsonl(f)
+    
+def write_tasks(tasks, f, format=FORMAT_JSONL):
+    """
+    Writes the tasks to the file object f. Returns the number of tasks.
+    """
+    if format == FORMAT_VTODO:
+        return write_vtodo(tasks, f)
+    return write_jsonl(tasks, f)
+    
+def import_tasks(db, f, format=FORMAT_JSONL):
+    """
+    Adds the tasks read from f to db in one go and commits db once. Tasks
+    with the id of an existing task replace it. Returns the number of
+    tasks read. If f can't be read completely db is left as it was.
+    """
+    count = [0]
+    
+    def counted():
+        for task in read_tasks(f, format):
+            count[0] += 1
+            yield task
+            
+    db.add_many(counted())
+    db.commit()
+    return count[0]
+    
+#JSON Lines
+def task_to_dict(task):
+    data = {"id": task.id, "created": task.created,
+            "modified": task.modified}
+    for id, field in task:
+        data[id] = task[id]
+    return data
+    
+def read_jsonl(f):
+    for n, line in enumerate(f):
+        line = line.strip()
+        if line == "":
+            continue
+        try:
+            data = json.loads(line)
+            yield make_task(data.get("id"), data.get("created"), \
+                            data.get("modified"), data.get("title", ""), \
+                            data.get("comment", ""), \
+                            data.get("due_date", -1), data.get("done", False))
+        except (ValueError, TypeError, AttributeError):
+            raise ErrorFormat("line %d" % (n + 1))
+            
+def write_jsonl(tasks, f):
+    count = 0
+    for task in tasks:
+        f.write(json.dumps(task_to_dict(task)) + "\n")
+        count += 1
+    return count
+    
+#iCalendar
+def read_vtodo(f):
+    """
+    Yields a task for every VTODO component in f. Other components and
+    components nested in a VTODO (e.g. alarms) are skipped.
+    """
+    props = None
+    depth = 0
+    for line in _unfold(f):
+        name, params, value = _parse_line(line)
+        if name == "BEGIN":
+            if props != None:
+                depth += 1
+            elif value.upper() == "VTODO":
+                props = {}
+        elif name == "END" and props != None:
+            if depth > 0:
+                depth -= 1
+            elif value.upper() == "VTODO":
+                yield _vtodo_to_task(props)
+                props = None
+        elif props != None and depth == 0:
+            props[name] = (params, value)
+            
+def write_vtodo(tasks, f):
+    f.write(_fold(u"BEGIN:VCALENDAR"))
+    f.write(_fold(u"VERSION:2.0"))
+    f.write(_fold(u"PRODID:" + PRODID))
+    count = 0
+    for task in tasks:
+        for line in _task_to_vtodo(task):
+            f.write(_fold(line))
+        count += 1
+    f.write(_fold(u"END:VCALENDAR"))
+    return count
+    
+def _vtodo_to_task(props):
+    try:
+        due_date = -1
+        if "DUE" in props:
+            due_date = _parse_due(*props["DUE"])
+        done = "COMPLETED" in props or \
+                props.get("STATUS", ({}, ""))[1].upper() == "COMPLETED" or \
+                props.get("PERCENT-COMPLETE", ({}, ""))[1] == "100"
+        created = None
+        if "CREATED" in props:
+            created = _parse_time(*props["CREATED"])
+        modified = None
+        for name in ["LAST-MODIFIED", "DTSTAMP"]:
+            if name in props:
+                modified = _parse_time(*props[name])
+                break
+        uid = None
+        if "UID" in props:
+            uid = props["UID"][1]
+        return make_task(uid, created, modified, \
+                            _unescape(props.get("SUMMARY", ({}, ""))[1]), \
+                            _unescape(props.get("DESCRIPTION", ({}, ""))[1]), \
+                            due_date, done)
+    except ValueError:
+        raise ErrorFormat(props.get("UID", ({}, ""))[1])
+        
+def _task_to_vtodo(task):
+    yield u"BEGIN:VTODO"
+    yield u"UID:" + _unicode(task.id)
+    yield u"DTSTAMP:" + _format_time(task.modified)
+    yield u"CREATED:" + _format_time(task.created)
+    yield u"LAST-MODIFIED:" + _format_time(task.modified)
+    yield u"SUMMARY:" + _escape(_unicode(task["title"]))
+    if task["comment"] != "":
+        yield u"DESCRIPTION:" + _escape(_unicode(task["comment"]))
+    if task["due_date"] != -1:
+        date = datetime.date.fromtimestamp(task["due_date"])
+        yield u"DUE;VALUE=DATE:" + date.strftime("%Y%m%d")
+    if task["done"]:
+        yield u"STATUS:COMPLETED"
+        yield u"COMPLETED:" + _format_time(task.field("done").modified)
+    else:
+        yield u"STATUS:NEEDS-ACTION"
+    yield u"END:VTODO"
+    
+def _unfold(f):
+    """
+    Yields the logical lines of an iCalendar file as unicode, continuation
+    lines start with a space or a tab.
+    """
+    line = None
+    for raw in f:
+        raw = raw.rstrip("\r\n").decode("utf-8", "replace")
+        if raw[:1] in (u" ", u"\t") and line != None:
+            line += raw[1:]
+            continue
+        if line != None and line != u"":
+            yield line
+        line = raw
+    if line != None and line != u"":
+        yield line
+        
+def _parse_line(line):
+    """
+    Splits a content line into its upper case name, its parameters and its
+    value. Colons and semicolons in quoted parameter values are kept.
+    """
+    colon = line.find(u":")
+    if colon != -1 and not u'"' in line[:colon]:
+        parts = line[:colon].split(u";")
+        start = colon + 1
+    else:
+        quoted = False
+        parts = []
+        start = 0
+        for i, c in enumerate(line):
+            if c == u'"':
+                quoted = not quoted
+            elif not quoted and c in (u";", u":"):
+                parts.append(line[start:i])
+                start = i + 1
+                if c == u":":
+                    break
+        else:
+            raise ErrorFormat(line)
+    params = {}
+    for param in parts[1:]:
+        key, sep, value = param.partition(u"=")
+        params[key.upper()] = value.strip(u'"')
+    return (parts[0].upper(), params, line[start:])
+    
+def _fold(line):
+    """
+    Encodes line as UTF-8 and folds it into lines of ICAL_LINE_LENGTH
+    octets without splitting a character.
+    """
+    data = line.encode("utf-8")
+    lines = []
+    while len(data) > ICAL_LINE_LENGTH:
+        cut = ICAL_LINE_LENGTH
+        while ord(data[cut]) & 0xc0 == 0x80:
+            cut -= 1
+        lines.append(data[:cut])
+        data = " " + data[cut:]
+    lines.append(data)
+    return "\r\n".join(lines) + "\r\n"
+    
+def _escape(text):
+    return text.replace(u"\\", u"\\\\").replace(u";", u"\\;") \
+                .replace(u",", u"\\,").replace(u"\n", u"\\n")
+                
+def _unescape(text):
+    return re.sub(r"\\(.)", lambda m: m.group(1).lower() == u"n" and u"\n" \
+                    or m.group(1), text)
+                    
+def _parse_time(params, value):
+    """
+    Converts a DATE-TIME (UTC or local time) or a DATE to a timestamp.
+    """
+    value = value.strip()
+    t = [int(value[0:4]), int(value[4:6]), int(value[6:8]), 0, 0, 0, 0, 0, -1]
+    if len(value) > 8:
+        if value[8] != u"T":
+            raise ValueError(value)
+        t[3:6] = [int(value[9:11]), int(value[11:13]), int(value[13:15])]
+        if value.endswith(u"Z"):
+            return calendar.timegm(t)
+    return time.mktime(t)
+    
+def _parse_due(params, value):
+    """
+    Converts a DUE value to a due date, i.e. 00:00:01 local time of the
+    due day as the screenlet and todo_cli.py store it.
+    """
+    date = datetime.date.fromtimestamp(_parse_time(params, value))
+    dt = datetime.datetime(date.year, date.month, date.day, 0, 0, 1)
+    return int(time.mktime(dt.timetuple()))
+    
+def _format_time(timestamp):
+    return unicode(time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(timestamp)))
+    
+def _unicode(value):
+    if isinstance(value, str):
+        return value.decode("utf-8", "replace")
+    return unicode(value)
+    
+def _text(value):
+    """
+    Returns value as str if it is plain ascii, the database only writes
+    unicode for other text.
+    """
+    if isinstance(value, unicode):
+        try:
+            return value.encode("ascii")
+        except UnicodeError:
+            pass
+    return value
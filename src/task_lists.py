@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       task_lists.py
+#       
+#       Copyright 2010 Sven Festersen <sven@sven-festersen.de>
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""
+Keeps the databases of the recently used task lists open. A list is opened
+when it is first needed, the least recently used one is closed once more
+than max_open lists are open, so inactive lists do not stay in memory.
+Lists that are held, e.g. while they are synced, are not closed until they
+are released. Changes have to be committed before their list is closed.
+Nothing in here may import GTK.
+"""
+import os
+
+import task_daemon
+from tasks import Task, get_list_filename
+
+#the active list and the one used before it
+MAX_OPEN_LISTS = 2
+
+
+class TaskLists(object):
+    """
+    The open task lists by name, most recently used last. on_open and
+    on_close are called with the name and the database of a list after it
+    was opened and before it is closed.
+    """
+    
+    def __init__(self, max_open=MAX_OPEN_LISTS, on_open=None, on_close=None):
+        super(TaskLists, self).__init__()
+        self.max_open = max_open
+        self._on_open = on_open
+        self._on_close = on_close
+        self._open = []
+        self._held = {}
+        
+    def get(self, name):
+        """
+        Returns the database of the task list name, shared with a running
+        task_daemon.py of the list if there is one. The list becomes the
+        most recently used one. A new list is created.
+        """
+        for i, (open_name, db) in enumerate(self._open):
+            if open_name == name:
+                del self._open[i]
+                self._open.append((name, db))
+                return db
+        filename = get_list_filename(name)
+        db = task_daemon.open_database(filename, Task, \
+                                        task_daemon.get_socket_path(name))
+        if not db.has_sync_source("ftp"):
+            db.add_sync_source("ftp")
+        if not isinstance(db, task_daemon.RemoteDataBase) and \
+                not os.path.exists(filename):
+            db.commit()
+        self._open.append((name, db))
+        if self._on_open != None:
+            self._on_open(name, db)
+        self._close_unused()
+        return db
+        
+    def hold(self, name):
+        """
+        Keeps the open list name open until release() was called as often
+        as hold(), even if it is not one of the recently used lists.
+        """
+        self._held[name] = self._held.get(name, 0) + 1
+        
+    def release(self, name):
+        self._held[name] -= 1
+        if self._held[name] == 0:
+            del self._held[name]
+        self._close_unused()
+        
+    def get_open_names(self):
+        return [name for name, db in self._open]
+        
+    def close_all(self):
+        while len(self._open) > 0:
+            self._close(*self._open.pop())
+            
+    def _close_unused(self):
+        #the least recently used lists first, never the active one
+        for name, db in self._open[:-1]:
+            if len(self._open) <= self.max_open:
+                break
+            if not name in self._held:
+                self._open.remove((name, db))
+                self._close(name, db)
+                
+    def _close(self, name, db):
+        if self._on_close != None:
+            self._on_close(name, db)
+        task_daemon.close_database(db)
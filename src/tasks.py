@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       tasks.py
+#       
+#       Copyright 2010 Sven Festersen <sven@sven-festersen.de>
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""
+The task data model, shared by the screenlet and the command line client.
+Nothing in here may import GTK.
+"""
+import os
+import re
+import time
+
+from simple_db.dataobject import DataObject
+from simple_db.index import SortedFieldIndex
+
+DEFAULT_DB_FILE = os.path.expanduser("~/.task_db.xml")
+#the default task list is the one in DEFAULT_DB_FILE, other lists are kept
+#in files of their own next to it
+DEFAULT_LIST = ""
+LIST_DB_FILE = os.path.expanduser("~/.task_db.%s.xml")
+
+_LIST_NAME_RE = re.compile("^[A-Za-z0-9_-]+$")
+_LIST_FILE_RE = re.compile("^\\.task_db\\.([A-Za-z0-9_-]+)\\.xml$")
+
+
+class Task(DataObject):
+    """
+    The task prototype for the database.
+    """
+    fields = ["title", "comment", "due_date", "done"]
+    #long comments are kept out of the database file
+    blob_fields = ["comment"]
+    
+    
+def new_task(title="New task", comment="", due_date=-1):
+    """
+    Creates a new undone task with a unique id.
+    """
+    t = Task(str(time.time()))
+    t["title"] = title
+    t["done"] = False
+    t["due_date"] = due_date
+    t["comment"] = comment
+    return t
+    
+def get_archivable_ids(db, days, done_ids=None):
+    """
+    Returns the ids of all tasks that have been done for more than days days.
+    done_ids can be the set of ids of done tasks if it is already known,
+    e.g. from an index.
+    """
+    cutoff = time.time() - days * 86400
+    if done_ids == None:
+        tasks = db.query(lambda x: x["done"])
+    else:
+        tasks = [db[id] for id in done_ids if id in db]
+    return [t.id for t in tasks if t["done"] and \
+            t.field("done").modified < cutoff]
+            
+def get_undone_due_index():
+    """
+    Returns a SortedFieldIndex on due_date that only holds the undone tasks,
+    to be added to a database for get_next_due_ids.
+    """
+    return SortedFieldIndex("due_date", lambda task: not task["done"])
+    
+def get_next_due_ids(db, undone_due_index, n):
+    """
+    Returns the ids of the n undone tasks that are due next, overdue tasks
+    first. undone_due_index is an index of db made by get_undone_due_index,
+    only its first n entries are read. Tasks without due date are not due
+    and are left out.
+    """
+    if n <= 0:
+        return []
+    #a sync may change the index and the tasks in another thread
+    return db.read(_scan_next_due, undone_due_index, n)
+    
+def _scan_next_due(undone_due_index, n):
+    ids = []
+    for due_date, id in undone_due_index.iter_from(0):
+        ids.append(id)
+        if len(ids) == n:
+            break
+    return ids
+    
+def is_list_name(name):
+    """
+    Returns True if name can be used as the name of a task list.
+    """
+    return name == DEFAULT_LIST or _LIST_NAME_RE.match(name) != None
+    
+def get_list_filename(name):
+    """
+    Returns the database file of the task list name.
+    """
+    if not is_list_name(name):
+        raise ValueError("invalid list name: %s" % name)
+    if name == DEFAULT_LIST:
+        return DEFAULT_DB_FILE
+    return LIST_DB_FILE % name
+    
+def get_list_names():
+    """
+    Returns the sorted names of all task lists that have a database file,
+    the default list is always included.
+    """
+    names = set([DEFAULT_LIST])
+    directory = os.path.dirname(LIST_DB_FILE)
+    if os.path.isdir(directory):
+        for filename in os.listdir(directory):
+            m = _LIST_FILE_RE.match(filename)
+            if m != None:
+                names.add(m.group(1))
+    return sorted(names)
@@ -21,6 +21,7 @@
 import cairo
 import ConfigParser
 import math
+import os
 
 
 def parse_color_rgba(color):
@@ -56,6 +57,8 @@ class ThemeInfo:
     scaleCorners = True
 
     def __init__(self, filename):
+        self._background = None
+        self._background_key = None
         conf = ConfigParser.SafeConfigParser()
         conf.read(filename)
 
@@ -79,7 +82,36 @@ class ThemeInfo:
         if conf.has_option("Layout", "scaleCorners"):
             self.scaleCorners = conf.getboolean("Layout", "scaleCorners")
             
+    def invalidate_cache(self):
+        """
+        Drops the pre-rendered background, e.g. after the scale changed.
+        """
+        self._background = None
+        self._background_key = None
+            
     def draw_background(self, ctx, width, height, scale=1.0):
+        """
+        Paints the background onto ctx. The background is rendered once per
+        (width, height, scale) into an offscreen surface and only painted
+        afterwards. ctx is expected to be scaled by scale already.
+        """
+        key = (width, height, scale)
+        if self._background_key != key:
+            surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, \
+                                            int(math.ceil(width * scale)), \
+                                            int(math.ceil(height * scale)))
+            sctx = cairo.Context(surface)
+            sctx.scale(scale, scale)
+            self.render_background(sctx, width, height, scale)
+            self._background = surface
+            self._background_key = key
+        ctx.save()
+        ctx.scale(1.0 / scale, 1.0 / scale)
+        ctx.set_source_surface(self._background, 0, 0)
+        ctx.paint()
+        ctx.restore()
+            
+    def render_background(self, ctx, width, height, scale=1.0):
         bscale = scale
         cscale = scale
         if self.scaleBorder:
@@ -98,3 +130,70 @@ class ThemeInfo:
         ctx.set_source_rgba(*self.backgroundColor)
         draw_rectangle(ctx, self.borderWidth / bscale, self.borderWidth / bscale, width - 2 * self.borderWidth / bscale, height - 2 * self.borderWidth / bscale, innerCornerRadius)
         ctx.fill()
+
+
+class ThemeRegistry:
+    """
+    Keeps the parsed ThemeInfo objects of all themes in a themes directory.
+    The directory is scanned once, later lookups only stat theme.conf
+    and parse it again if it changed on disk.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._themes = {}
+        self.scan()
+        
+    def scan(self):
+        """
+        Parses all themes in the directory that are not cached yet.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if os.path.isfile(os.path.join(path, "theme.conf")):
+                self.get(path)
+                
+    def names(self):
+        """
+        Returns the names of the cached themes.
+        """
+        names = [os.path.basename(path) for path in self._themes]
+        names.sort()
+        return names
+        
+    def get(self, path):
+        """
+        Returns the ThemeInfo for the theme in directory path.
+        """
+        path = os.path.normpath(path)
+        conf_file = os.path.join(path, "theme.conf")
+        mtime = get_mtime(conf_file)
+        cached = self._themes.get(path)
+        if cached != None and cached[0] == mtime:
+            return cached[1]
+        info = ThemeInfo(conf_file)
+        self._themes[path] = (mtime, info)
+        return info
+        
+        
+def get_mtime(filename):
+    try:
+        return os.stat(filename).st_mtime
+    except OSError:
+        return None
+        
+
+_registries = {}
+
+def get_theme_info(path):
+    """
+    Returns the ThemeInfo for the theme in directory path from the registry
+    of its themes directory.
+    """
+    path = os.path.normpath(path)
+    directory = os.path.dirname(path)
+    if not directory in _registries:
+        _registries[directory] = ThemeRegistry(directory)
+    return _registries[directory].get(path)
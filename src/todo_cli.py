@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       todo_cli.py
+#       
+#       Copyright 2010 Sven Festersen <sven@sven-festersen.de>
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""
+Command line client for the task database. It only needs simple_db, GTK is
+never imported, so it starts fast enough to be used from scripts and cron
+jobs.
+
+Usage: todo_cli.py [options] list|add|done|query|export|import|archive|sync|
+            lists [arguments]
+"""
+import datetime
+import optparse
+import os
+import sys
+import time
+
+from simple_db.database import DataBase
+from tasks import Task, new_task, get_archivable_ids, DEFAULT_LIST, \
+                    get_list_filename, get_list_names
+
+USAGE = """%prog [options] command [arguments]
+
+commands:
+  list                  list undone tasks (all tasks with --all)
+  add TITLE             add a task (see --due and --comment)
+  done ID...            mark tasks as done (undone with --undo)
+  query TEXT            list tasks matching TEXT in title or comment
+  export                write all tasks as JSON lines or iCalendar VTODOs
+                        (see --output and --format)
+  import FILE...        add the tasks in JSON lines or iCalendar files, - is
+                        stdin (see --format)
+  archive               archive tasks done for more than --days days
+  sync                  sync with the remote data (see --server etc.)
+  lists                 list the names of the task lists (see --list)"""
+
+
+def parse_date(s):
+    """
+    Converts a date in the format YYYY-MM-DD to a due date timestamp.
+    """
+    dt = datetime.datetime.strptime(s, "%Y-%m-%d")
+    dt = datetime.datetime(dt.year, dt.month, dt.day, 0, 0, 1)
+    return int(time.mktime(dt.timetuple()))
+    
+def format_task(task):
+    done = " "
+    if task["done"]:
+        done = "x"
+    due = "-" * 10
+    if task["due_date"] != -1:
+        due = datetime.date.fromtimestamp(task["due_date"]).isoformat()
+    return "%s  [%s] %s  %s" % (task.id, done, due, task["title"])
+    
+def sort_by_due_date(x, y):
+    return cmp(x["due_date"], y["due_date"])
+    
+def print_tasks(tasks):
+    for task in tasks:
+        line = format_task(task)
+        if isinstance(line, unicode):
+            #imported tasks may have non-ascii titles
+            line = line.encode("utf-8")
+        print line
+        
+        
+def cmd_list(db, options, args):
+    if options.all:
+        print_tasks(db.query(sort_func=sort_by_due_date))
+    else:
+        print_tasks(db.query(lambda x: not x["done"], sort_by_due_date))
+        
+def cmd_add(db, options, args):
+    if len(args) == 0:
+        raise optparse.OptParseError("add needs a title")
+    due_date = -1
+    if options.due != None:
+        due_date = parse_date(options.due)
+    t = new_task(" ".join(args), options.comment, due_date)
+    db.add(t)
+    db.commit()
+    print t.id
+    
+def cmd_done(db, options, args):
+    for id in args:
+        if not id in db:
+            sys.exit("unknown task: %s" % id)
+    for id in args:
+        db[id]["done"] = not options.undo
+    db.commit()
+    
+def cmd_query(db, options, args):
+    from simple_db.index import TokenIndex
+    index = TokenIndex(["title", "comment"])
+    db.add_index(index)
+    ids = index.search(" ".join(args))
+    if ids == None:
+        ids = set()
+    print_tasks(db.query(lambda x: x.id in ids, sort_by_due_date))
+    
+def cmd_export(db, options, args):
+    import task_io
+    from simple_db import stream
+    format = options.format or task_io.get_format(options.output)
+    out = sys.stdout
+    if options.output != None:
+        out = open(options.output, "w")
+    #the tasks are streamed from the file in file order, the database is
+    #not loaded
+    task_io.write_tasks(stream.iter_objects(db.filename, Task), out, format)
+    if out != sys.stdout:
+        out.close()
+        
+def cmd_import(db, options, args):
+    import task_io
+    if len(args) == 0:
+        raise optparse.OptParseError("import needs a file")
+    for filename in args:
+        format = options.format or task_io.get_format(filename)
+        f = sys.stdin
+        if filename != "-":
+            f = open(filename, "r")
+        try:
+            n = task_io.import_tasks(db, f, format)
+        except task_io.ErrorFormat, e:
+            sys.exit("%s: can't read %s" % (filename, e))
+        finally:
+            if f != sys.stdin:
+                f.close()
+        print "%d tasks imported from %s" % (n, filename)
+        
+def cmd_archive(db, options, args):
+    ids = get_archivable_ids(db, options.days)
+    db.archive(ids)
+    db.commit()
+    print "%d tasks archived" % len(ids)
+        
+def cmd_sync(db, options, args):
+    import sync_core
+    import sync_trace
+    if options.server == None:
+        raise optparse.OptParseError("sync needs --server")
+    if not db.has_sync_source("ftp"):
+        db.add_sync_source("ftp")
+    history = sync_trace.SyncHistory( \
+                                os.path.expanduser("~/.task_sync_history"))
+    try:
+        sync_core.sync_all(db, Task, options.server, options.user, \
+                            options.password, options.dir, options.remote, \
+                            options.force, history, list_name=options.list)
+    except sync_core.ErrorLocked:
+        sys.exit("The remote data is locked, use --force to sync anyway.")
+    except sync_core.Error, e:
+        sys.exit("Sync failed: %s %s" % (e.__class__.__name__, \
+                                            " ".join(map(str, e.args))))
+    for entry in history.entries()[-1 - len(options.remote):]:
+        print sync_trace.format_entry(entry)
+    
+def cmd_lists(db, options, args):
+    for name in get_list_names():
+        print name or "(default)"
+        
+COMMANDS = {"list": cmd_list,
+            "add": cmd_add,
+            "done": cmd_done,
+            "query": cmd_query,
+            "export": cmd_export,
+            "import": cmd_import,
+            "archive": cmd_archive,
+            "sync": cmd_sync,
+            "lists": cmd_lists}
+            
+            
+def main(argv):
+    parser = optparse.OptionParser(usage=USAGE)
+    parser.add_option("-l", "--list", default=DEFAULT_LIST, \
+                        help="name of the task list [default: the default " \
+                        "list]")
+    parser.add_option("-f", "--file", \
+                        help="task database file [default: the file of the " \
+                        "list]")
+    parser.add_option("-a", "--all", action="store_true", default=False, \
+                        help="list: include done tasks")
+    parser.add_option("--due", help="add: due date as YYYY-MM-DD")
+    parser.add_option("--comment", default="", help="add: comment")
+    parser.add_option("--undo", action="store_true", default=False, \
+                        help="done: mark tasks as undone")
+    parser.add_option("-o", "--output", help="export: output file")
+    parser.add_option("--format", type="choice", choices=["jsonl", "ics"], \
+                        help="export, import: jsonl or ics [default: by file " \
+                        "extension, jsonl]")
+    parser.add_option("--days", type="int", default=30, \
+                        help="archive: minimum days since done [default: %default]")
+    parser.add_option("--server", help="sync: ftp server or URL (ftp://, " \
+                        "file://, http(s)://, dav(s)://)")
+    parser.add_option("--user", default="", help="sync: ftp username")
+    parser.add_option("--password", default="", help="sync: ftp password")
+    parser.add_option("--dir", default="/", help="sync: ftp directory")
+    parser.add_option("--force", action="store_true", default=False, \
+                        help="sync: ignore the remote lock")
+    parser.add_option("--remote", action="append", default=[], \
+                        help="sync: URL of an additional remote, can be " \
+                        "given several times")
+    options, args = parser.parse_args(argv)
+    if len(args) == 0 or not args[0] in COMMANDS:
+        parser.error("unknown command")
+    if options.file == None:
+        try:
+            options.file = get_list_filename(options.list)
+        except ValueError, e:
+            parser.error(str(e))
+    #export streams the database file itself, lists needs no database
+    db = DataBase(options.file, Task, \
+                    load=not args[0] in ("export", "lists"))
+    try:
+        COMMANDS[args[0]](db, options, args[1:])
+    except (optparse.OptParseError, ValueError), e:
+        parser.error(str(e))
+    
+    
+if __name__ == '__main__':
+    main(sys.argv[1:])
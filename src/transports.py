@@ -0,0 +1,589 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       transports.py
+#       
+#       Copyright 2010 Sven Festersen <sven@sven-festersen.de>
+#       
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#       
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#       
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+"""
+Transports give sync_core access to the remote data. A transport stores the
+database file and a lock file and supports conditional downloads and
+uploads with etags:
+
+  FTPTransport          a directory on an ftp server
+  LocalTransport        a local or mounted directory
+  WebDAVTransport       a collection on a WebDAV or plain HTTP server that
+                        accepts PUT and DELETE
+
+The lock is a lease: the lock file holds the id of the client holding it
+and the time the lease expires, so a lock left behind by a crashed client
+is ignored once the lease is over.
+"""
+import base64
+import calendar
+import ftplib
+import httplib
+import os
+import StringIO
+import time
+import urllib
+import urlparse
+
+from sync_errors import *
+
+REMOTE_DB_FILE = ".task_db.xml"
+REMOTE_LOCK_FILE = ".task-lock"
+#the files of other task lists than the default one, see Transport.set_list
+REMOTE_LIST_DB_FILE = ".task_db.%s.xml"
+REMOTE_LIST_LOCK_FILE = ".task-lock.%s"
+#blobs (see simple_db.blobs) are stored as REMOTE_BLOB_PREFIX + hash
+REMOTE_BLOB_PREFIX = ".task-blob-"
+#seconds a remote lock stays valid unless it is renewed
+LOCK_LEASE = 300
+
+#results of Transport.get()
+GET_MODIFIED = 0
+GET_NOT_MODIFIED = 1
+GET_MISSING = 2
+
+
+class Transport(object):
+    """
+    The base class of all transports. Subclasses implement the data access
+    (connect, close, get, put, get_blob, put_blob) and the access to the
+    lock file (_read_lock, _write_lock, _delete_lock), the lease logic is
+    implemented here.
+    """
+    
+    name = ""
+    db_file = REMOTE_DB_FILE
+    lock_file = REMOTE_LOCK_FILE
+    
+    def __init__(self):
+        super(Transport, self).__init__()
+        self.client_id = None
+        self._lock_written = 0
+        
+    def set_list(self, list_name):
+        """
+        Makes the transport use the database and the lock file of the task
+        list list_name ("" is the default list). Every list has a lock of
+        its own, so the lists are synced independently. Blobs are shared.
+        """
+        if list_name == "":
+            self.db_file = REMOTE_DB_FILE
+            self.lock_file = REMOTE_LOCK_FILE
+        else:
+            self.db_file = REMOTE_LIST_DB_FILE % list_name
+            self.lock_file = REMOTE_LIST_LOCK_FILE % list_name
+        
+    def connect(self):
+        pass
+        
+    def close(self):
+        pass
+        
+    def get(self, etag=None, callback=None):
+        """
+        Downloads the database file unless its etag is etag. Returns
+        (status, data, etag) with status GET_MODIFIED, GET_NOT_MODIFIED (data
+        is None) or GET_MISSING (data and etag are None). callback is called
+        with every received block.
+        """
+        raise NotImplementedError
+        
+    def put(self, data, etag=None, callback=None):
+        """
+        Uploads the database file and returns its new etag or None. Raises
+        ErrorConflict if etag is given and the file was changed since.
+        """
+        raise NotImplementedError
+        
+    def get_blob(self, hash, callback=None):
+        """
+        Downloads the blob with the given hash. Raises ErrorDownload if
+        there is none.
+        """
+        raise NotImplementedError
+        
+    def put_blob(self, hash, data, callback=None):
+        """
+        Uploads a blob. Blobs never change, so there is no etag.
+        """
+        raise NotImplementedError
+        
+    def _read_lock(self):
+        """
+        Returns the contents of the lock file or None if there is none.
+        """
+        raise NotImplementedError
+        
+    def _write_lock(self, data, exists):
+        """
+        Writes the lock file, exists tells whether it existed when it was
+        read last.
+        """
+        raise NotImplementedError
+        
+    def _delete_lock(self):
+        raise NotImplementedError
+        
+    def _lock_mtime(self):
+        """
+        Returns the modification time of the lock file or None.
+        """
+        return None
+        
+    def probe_lock(self):
+        """
+        Returns (client id, expiry) of the current lock or None.
+        """
+        data = self._read_lock()
+        if data == None:
+            return None
+        try:
+            client_id, expiry = data.split()
+            return (client_id, float(expiry))
+        except ValueError:
+            #an empty lock written by an older version, its lease starts
+            #with the modification time
+            mtime = self._lock_mtime()
+            if mtime == None:
+                mtime = time.time()
+            return ("", mtime + LOCK_LEASE)
+            
+    def _write_lease(self, exists):
+        self._write_lock("%s %s\n" % (self.client_id, \
+                                        time.time() + LOCK_LEASE), exists)
+        self._lock_written = time.time()
+        
+    def lock(self, client_id, force=False):
+        self.client_id = client_id
+        lock = self.probe_lock()
+        if lock != None and lock[0] != client_id and \
+                lock[1] > time.time() and not force:
+            raise ErrorLocked()
+        self._write_lease(lock != None)
+        #another client may have taken the lock at the same time
+        lock = self.probe_lock()
+        if lock == None or lock[0] != client_id:
+            raise ErrorLocked()
+            
+    def renew(self):
+        """
+        Extends the lease once half of it is over.
+        """
+        if time.time() - self._lock_written > LOCK_LEASE / 2:
+            self._write_lease(True)
+            
+    def unlock(self):
+        """
+        Deletes the lock file unless the lease expired and another client
+        took the lock since.
+        """
+        lock = self.probe_lock()
+        if lock != None and lock[0] == self.client_id:
+            self._delete_lock()
+        
+        
+class FTPTransport(Transport):
+    """
+    Stores the data in a directory on an ftp server, server may be given as
+    host:port. The etag of a file is made of its size and modification
+    time.
+    """
+    
+    def __init__(self, server, username, password, directory):
+        super(FTPTransport, self).__init__()
+        self.name = server
+        self._server = server
+        self._username = username
+        self._password = password
+        self._directory = directory
+        self._ftp = None
+        
+    def connect(self):
+        host, port = self._server, 0
+        if ":" in host:
+            host, port = host.rsplit(":", 1)
+        try:
+            self._ftp = ftplib.FTP()
+            self._ftp.connect(host, int(port))
+            self._ftp.login(self._username, self._password)
+        except:
+            raise ErrorConnect(self._server)
+        try:
+            self._ftp.cwd(self._directory)
+        except:
+            raise ErrorDirectory(self._directory)
+        self._ftp.voidcmd("TYPE I")
+        
+    def close(self):
+        try:
+            self._ftp.quit()
+        except:
+            pass
+            
+    def _size(self, filename):
+        try:
+            return self._ftp.size(filename)
+        except ftplib.error_perm:
+            return None
+            
+    def _mtime(self, filename):
+        try:
+            resp = self._ftp.sendcmd("MDTM " + filename)
+            return calendar.timegm(time.strptime(resp[4:18], "%Y%m%d%H%M%S"))
+        except (ftplib.Error, ValueError):
+            return None
+            
+    def _etag(self):
+        size = self._size(self.db_file)
+        if size == None:
+            return None
+        return "%s:%s" % (size, self._mtime(self.db_file))
+        
+    def get(self, etag=None, callback=None):
+        current = self._etag()
+        if current == None:
+            return (GET_MISSING, None, None)
+        if current == etag:
+            return (GET_NOT_MODIFIED, None, etag)
+        return (GET_MODIFIED, self._retr(self.db_file, callback), current)
+        
+    def put(self, data, etag=None, callback=None):
+        if etag != None and self._etag() != etag:
+            raise ErrorConflict()
+        self._stor(self.db_file, data, callback)
+        return self._etag()
+        
+    def get_blob(self, hash, callback=None):
+        return self._retr(REMOTE_BLOB_PREFIX + hash, callback)
+        
+    def put_blob(self, hash, data, callback=None):
+        self._stor(REMOTE_BLOB_PREFIX + hash, data, callback)
+        
+    def _retr(self, filename, callback):
+        data = []
+        def retr_callback(block):
+            data.append(block)
+            if callback != None:
+                callback(block)
+        try:
+            self._ftp.retrbinary("RETR " + filename, retr_callback)
+        except:
+            raise ErrorDownload()
+        return "".join(data)
+        
+    def _stor(self, filename, data, callback):
+        try:
+            self._ftp.storbinary("STOR " + filename, \
+                                    StringIO.StringIO(data), callback=callback)
+        except:
+            raise ErrorWrite()
+        
+    def _read_lock(self):
+        if self._size(self.lock_file) == None:
+            return None
+        data = []
+        try:
+            self._ftp.retrbinary("RETR " + self.lock_file, data.append)
+        except ftplib.error_perm:
+            #released in the meantime
+            return None
+        return "".join(data)
+        
+    def _write_lock(self, data, exists):
+        try:
+            self._ftp.storbinary("STOR " + self.lock_file, \
+                                    StringIO.StringIO(data))
+        except:
+            raise ErrorWrite()
+            
+    def _delete_lock(self):
+        try:
+            self._ftp.delete(self.lock_file)
+        except:
+            raise ErrorWrite()
+            
+    def _lock_mtime(self):
+        return self._mtime(self.lock_file)
+        
+        
+class LocalTransport(Transport):
+    """
+    Stores the data in a local or mounted directory. Files are replaced
+    atomically by renaming.
+    """
+    
+    def __init__(self, directory):
+        super(LocalTransport, self).__init__()
+        self.name = directory
+        self._directory = directory
+        
+    def _path(self, filename):
+        return os.path.join(self._directory, filename)
+        
+    def connect(self):
+        if not os.path.isdir(self._directory):
+            raise ErrorDirectory(self._directory)
+            
+    def _etag(self):
+        try:
+            st = os.stat(self._path(self.db_file))
+        except OSError:
+            return None
+        return "%s:%s:%r" % (st.st_ino, st.st_size, st.st_mtime)
+        
+    def _read(self, filename):
+        try:
+            f = open(self._path(filename), "rb")
+        except IOError:
+            return None
+        try:
+            return f.read()
+        finally:
+            f.close()
+            
+    def _write(self, filename, data):
+        tmp = self._path(filename + ".tmp")
+        f = open(tmp, "wb")
+        f.write(data)
+        f.close()
+        os.rename(tmp, self._path(filename))
+        
+    def get(self, etag=None, callback=None):
+        current = self._etag()
+        if current == None:
+            return (GET_MISSING, None, None)
+        if current == etag:
+            return (GET_NOT_MODIFIED, None, etag)
+        data = self._read(self.db_file)
+        if data == None:
+            raise ErrorDownload()
+        if callback != None:
+            callback(data)
+        return (GET_MODIFIED, data, self._etag())
+        
+    def put(self, data, etag=None, callback=None):
+        if etag != None and self._etag() != etag:
+            raise ErrorConflict()
+        try:
+            self._write(self.db_file, data)
+        except (IOError, OSError):
+            raise ErrorWrite()
+        if callback != None:
+            callback(data)
+        return self._etag()
+        
+    def get_blob(self, hash, callback=None):
+        data = self._read(REMOTE_BLOB_PREFIX + hash)
+        if data == None:
+            raise ErrorDownload()
+        if callback != None:
+            callback(data)
+        return data
+        
+    def put_blob(self, hash, data, callback=None):
+        try:
+            self._write(REMOTE_BLOB_PREFIX + hash, data)
+        except (IOError, OSError):
+            raise ErrorWrite()
+        if callback != None:
+            callback(data)
+            
+    def _read_lock(self):
+        return self._read(self.lock_file)
+        
+    def _write_lock(self, data, exists):
+        try:
+            self._write(self.lock_file, data)
+        except (IOError, OSError):
+            raise ErrorWrite()
+            
+    def _delete_lock(self):
+        try:
+            os.remove(self._path(self.lock_file))
+        except OSError:
+            raise ErrorWrite()
+            
+    def _lock_mtime(self):
+        try:
+            return os.path.getmtime(self._path(self.lock_file))
+        except OSError:
+            return None
+            
+            
+class WebDAVTransport(Transport):
+    """
+    Stores the data in a collection on a WebDAV or plain HTTP server that
+    supports PUT and DELETE. Downloads use If-None-Match, so an unchanged
+    file costs a 304 response. Uploads and lock takeovers use If-Match and
+    the lock is created with If-None-Match: *, so two clients can't take it
+    at the same time.
+    """
+    
+    def __init__(self, url, username="", password=""):
+        super(WebDAVTransport, self).__init__()
+        self.name = url
+        parts = urlparse.urlsplit(url)
+        self._https = parts.scheme in ("https", "davs")
+        self._host = parts.netloc
+        self._path = parts.path.rstrip("/") + "/"
+        self._headers = {}
+        if username != "":
+            self._headers["Authorization"] = "Basic " + \
+                        base64.b64encode("%s:%s" % (username, password))
+        self._conn = None
+        self._lock_etag = None
+        
+    def connect(self):
+        if self._https:
+            self._conn = httplib.HTTPSConnection(self._host)
+        else:
+            self._conn = httplib.HTTPConnection(self._host)
+        try:
+            self._conn.connect()
+        except Exception:
+            raise ErrorConnect(self._host)
+            
+    def close(self):
+        self._conn.close()
+        
+    def _request(self, method, filename, body=None, headers={}):
+        all_headers = dict(self._headers)
+        all_headers.update(headers)
+        try:
+            self._conn.request(method, self._path + filename, body, \
+                                all_headers)
+            response = self._conn.getresponse()
+            data = response.read()
+        except (httplib.HTTPException, IOError):
+            #the server may have closed a kept alive connection
+            self._conn.close()
+            try:
+                self._conn.request(method, self._path + filename, body, \
+                                    all_headers)
+                response = self._conn.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, IOError):
+                raise ErrorConnect(self._host)
+        return (response.status, response.getheader("etag"), data)
+        
+    def get(self, etag=None, callback=None):
+        headers = {}
+        if etag != None:
+            headers["If-None-Match"] = etag
+        status, new_etag, data = self._request("GET", self.db_file, \
+                                                headers=headers)
+        if status == 304:
+            return (GET_NOT_MODIFIED, None, etag)
+        elif status == 404:
+            return (GET_MISSING, None, None)
+        elif status == 200:
+            if callback != None:
+                callback(data)
+            return (GET_MODIFIED, data, new_etag)
+        elif status in (401, 403):
+            raise ErrorDirectory(self._path)
+        raise ErrorDownload(status)
+        
+    def put(self, data, etag=None, callback=None):
+        headers = {}
+        if etag != None:
+            headers["If-Match"] = etag
+        status, new_etag, body = self._request("PUT", self.db_file, data, \
+                                                headers)
+        if status == 412:
+            raise ErrorConflict()
+        elif not status in (200, 201, 204):
+            raise ErrorWrite(status)
+        if callback != None:
+            callback(data)
+        return new_etag
+        
+    def get_blob(self, hash, callback=None):
+        status, etag, data = self._request("GET", REMOTE_BLOB_PREFIX + hash)
+        if status != 200:
+            raise ErrorDownload(status)
+        if callback != None:
+            callback(data)
+        return data
+        
+    def put_blob(self, hash, data, callback=None):
+        status, etag, body = self._request("PUT", REMOTE_BLOB_PREFIX + hash, \
+                                            data)
+        if not status in (200, 201, 204):
+            raise ErrorWrite(status)
+        if callback != None:
+            callback(data)
+        
+    def _read_lock(self):
+        status, etag, data = self._request("GET", self.lock_file)
+        if status == 404:
+            self._lock_etag = None
+            return None
+        elif status != 200:
+            raise ErrorDownload(status)
+        self._lock_etag = etag
+        return data
+        
+    def _write_lock(self, data, exists):
+        if exists and self._lock_etag != None:
+            headers = {"If-Match": self._lock_etag}
+        elif exists:
+            headers = {}
+        else:
+            headers = {"If-None-Match": "*"}
+        status, etag, body = self._request("PUT", self.lock_file, data, \
+                                            headers)
+        if status == 412:
+            raise ErrorLocked()
+        elif not status in (200, 201, 204):
+            raise ErrorWrite(status)
+        self._lock_etag = etag
+        
+    def _delete_lock(self):
+        status, etag, data = self._request("DELETE", self.lock_file)
+        if not status in (200, 204, 404):
+            raise ErrorWrite(status)
+            
+            
+def get_transport(server, username="", password="", directory="/"):
+    """
+    Returns the transport for server. server can be an ftp host name (data
+    in directory) or a URL: ftp://host/dir, file:///dir, http(s)://host/dir
+    or dav(s)://host/dir. Credentials in the URL (scheme://user:pw@host/dir)
+    take precedence over username and password.
+    """
+    if not "://" in server:
+        return FTPTransport(server, username, password, directory)
+    parts = urlparse.urlsplit(server)
+    host = parts.netloc
+    if parts.username != None:
+        username = urllib.unquote(parts.username)
+        password = urllib.unquote(parts.password or "")
+        host = host.rsplit("@", 1)[1]
+    if parts.scheme == "ftp":
+        return FTPTransport(host, username, password, parts.path or "/")
+    elif parts.scheme == "file":
+        return LocalTransport(parts.path)
+    elif parts.scheme in ("http", "https", "dav", "davs"):
+        url = urlparse.urlunsplit((parts.scheme, host, parts.path, \
+                                    parts.query, ""))
+        return WebDAVTransport(url, username, password)
+    raise ErrorConnect(server)